@@ -0,0 +1,357 @@
+"""
+.. module:: BinaryIndex
+    :noindex:
+.. moduleauthor:: Filipe Pires [85122] & Joao Alegria [85048]
+"""
+import zlib
+from array import array
+from itertools import accumulate, groupby
+from operator import itemgetter
+
+# identifies the index files written in the binary format, it's followed by one byte with the flags below
+BINMAGIC = b"RIBINDEX1"
+WEIGHTSFLAG = 1
+POSITIONSFLAG = 2
+# set in the intermediate indexes whose records are compressed with zlib, in chunks (see IndexWriter.PartitionWriter)
+COMPRESSEDFLAG = 4
+# weights and idfs are rounded to 2 decimal places, so they are stored, without loss, as integer hundredths
+QUANTUM = 100
+# typecodes of the arrays used to pack the gaps, by width in bytes
+GAPTYPECODES = {1: "B", 2: "H", 4: "I"}
+
+
+def writeVarint(out, value):
+    """
+    Function that appends a non negative integer to a buffer, using 7 bits per byte and the highest bit to tell if more bytes follow.
+
+    :param out: buffer being written
+    :type out: bytearray
+    :param value: integer to be written
+    :type value: int
+
+    """
+    while value >= 128:
+        out.append((value & 127) | 128)
+        value >>= 7
+    out.append(value)
+
+
+def readVarint(buf, pos):
+    """
+    Function that reads an integer written by writeVarint.
+
+    :param buf: buffer being read
+    :type buf: bytes or mmap
+    :param pos: position of the integer in the buffer
+    :type pos: int
+    :returns: the integer and the position after it
+    :rtype: tuple<int, int>
+
+    """
+    # most of the integers (gaps, counts, lengths) fit in a single byte
+    value = buf[pos]
+    if value < 128:
+        return value, pos+1
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 127) << shift
+        if byte < 128:
+            return value, pos
+        shift += 7
+
+
+def writeIncreasing(out, values):
+    """
+    Function that appends a list of increasing integers (docIDs or positions) to a buffer: their number and the first one as varints, followed by the gaps between them, packed with the smallest width (1, 2 or 4 bytes) that fits the biggest one.
+
+    :param out: buffer being written
+    :type out: bytearray
+    :param values: increasing integers
+    :type values: list<int>
+
+    """
+    writeVarint(out, len(values))
+    if len(values) == 0:
+        return
+    writeVarint(out, values[0])
+    if len(values) == 1:
+        return
+    gaps = [b-a for a, b in zip(values, values[1:])]
+    top = max(gaps)
+    width = 1 if top < 256 else 2 if top < 65536 else 4
+    out.append(width)
+    out += array(GAPTYPECODES[width], gaps).tobytes()
+
+
+def readIncreasing(buf, pos):
+    """
+    Function that reads a list of integers written by writeIncreasing.
+
+    :param buf: buffer being read
+    :type buf: bytes or mmap
+    :param pos: position of the list in the buffer
+    :type pos: int
+    :returns: the integers and the position after them
+    :rtype: tuple<list<int>, int>
+
+    """
+    count, pos = readVarint(buf, pos)
+    if count == 0:
+        return [], pos
+    first, pos = readVarint(buf, pos)
+    if count == 1:
+        return [first], pos
+    width = buf[pos]
+    end = pos+1+width*(count-1)
+    gaps = array(GAPTYPECODES[width])
+    gaps.frombytes(buf[pos+1:end])
+    return list(accumulate(gaps, initial=first)), end
+
+
+def encodeRecord(term, idf, df, postings, positions):
+    """
+    Function that builds the record of one term from its already encoded postings and positions: the term and the length of the rest of the record, followed by the idf (in hundredths), the number of postings, the length of the postings and both parts.
+    Since the length of the record comes right after the term, a reader looking for some terms skips the others without decoding them, and since the positions come last, a reader that only needs the postings never decodes them.
+
+    :param term: the term
+    :type term: str
+    :param idf: idf of the term, in hundredths (0 if the weights aren't stored)
+    :type idf: int
+    :param df: number of postings of the term
+    :type df: int
+    :param postings: encoded postings, as written by encodeTerm
+    :type postings: bytes
+    :param positions: encoded positions, as written by encodeTerm (empty if the positions aren't stored)
+    :type positions: bytes
+    :returns: the record
+    :rtype: bytearray
+
+    """
+    body = bytearray()
+    writeVarint(body, idf)
+    writeVarint(body, df)
+    writeVarint(body, len(postings))
+    body += postings
+    body += positions
+    term = term.encode("utf-8")
+    record = bytearray()
+    writeVarint(record, len(term))
+    record += term
+    writeVarint(record, len(body))
+    record += body
+    return record
+
+
+def encodeTerm(term, idf, postings):
+    """
+    Function that builds the record of one term.
+    The postings are kept in the order of their values (weights or term frequencies), which are written once for each group of documents with the same value, followed by the docIDs of the group with writeIncreasing.
+    The positions of each document are written in the same order, with writeIncreasing too.
+
+    :param term: the term
+    :type term: str
+    :param idf: idf of the term, in hundredths (0 if the weights aren't stored)
+    :type idf: int
+    :param postings: triples (value, docID, positions), sorted by decreasing value and increasing docID, the value is the weight in hundredths or the term frequency, the positions are None if they aren't stored
+    :type postings: list<tuple<int, int, list<int>>>
+    :returns: the record
+    :rtype: bytearray
+
+    """
+    encoded = bytearray()
+    for value, group in groupby(postings, key=itemgetter(0)):
+        writeVarint(encoded, value)
+        writeIncreasing(encoded, [docID for value, docID, positions in group])
+    positions = bytearray()
+    if len(postings) > 0 and postings[0][2] is not None:
+        for posting in postings:
+            writeIncreasing(positions, posting[2])
+    return encodeRecord(term, idf, len(postings), encoded, positions)
+
+
+def readRecords(buf, pos=len(BINMAGIC)+1):
+    """
+    Generator that reads the terms of an index file in the binary format, without decoding the rest of their records.
+
+    :param buf: contents of the file
+    :type buf: bytes or mmap
+    :param pos: position of the first record, right after the magic number and the flags by default
+    :type pos: int
+    :returns: generator of tuples (term, position of the rest of the record, position after the record)
+    :rtype: generator<tuple<str, int, int>>
+
+    """
+    size = len(buf)
+    while pos < size:
+        length, pos = readVarint(buf, pos)
+        term = str(buf[pos:pos+length], "utf-8")
+        length, pos = readVarint(buf, pos+length)
+        yield term, pos, pos+length
+        pos += length
+
+
+def readCompressedRecords(buf, pos=len(BINMAGIC)+1):
+    """
+    Generator that reads the terms of an intermediate index whose records are compressed in chunks, decompressing one chunk at a time.
+
+    :param buf: contents of the file
+    :type buf: bytes or mmap
+    :param pos: position of the first chunk, right after the magic number and the flags by default
+    :type pos: int
+    :returns: generator of tuples (decompressed chunk, term, position of the rest of the record in the chunk, position after the record in the chunk)
+    :rtype: generator<tuple<bytes, str, int, int>>
+
+    """
+    size = len(buf)
+    while pos < size:
+        length, pos = readVarint(buf, pos)
+        chunk = zlib.decompress(buf[pos:pos+length])
+        pos += length
+        for term, start, end in readRecords(chunk, 0):
+            yield chunk, term, start, end
+
+
+def readHeader(buf, pos):
+    """
+    Function that reads the rest of the header of a record, after its term.
+
+    :param buf: contents of the file
+    :type buf: bytes or mmap
+    :param pos: position of the rest of the record, as given by readRecords
+    :type pos: int
+    :returns: the idf in hundredths, the number of postings, the position of the postings and the position of the positions
+    :rtype: tuple<int, int, int, int>
+
+    """
+    idf, pos = readVarint(buf, pos)
+    df, pos = readVarint(buf, pos)
+    length, pos = readVarint(buf, pos)
+    return idf, df, pos, pos+length
+
+
+def recordPostings(record):
+    """
+    Function that finds the postings in a record built by encodeRecord.
+
+    :param record: the record
+    :type record: bytes
+    :returns: the number of postings, their position in the record and the position of the positions
+    :rtype: tuple<int, int, int>
+
+    """
+    term, pos, end = next(readRecords(record, 0))
+    idf, df, start, end = readHeader(record, pos)
+    return df, start, end
+
+
+def decodePostings(buf, pos, end, limit=None):
+    """
+    Function that decodes the postings of a record, in the order they were written.
+
+    :param buf: contents of the file
+    :type buf: bytes or mmap
+    :param pos: position of the postings, as given by readHeader
+    :type pos: int
+    :param end: position of the positions, as given by readHeader
+    :type end: int
+    :param limit: maximum number of postings to be decoded (for instance, the size of the champions list), None to decode them all
+    :type limit: int
+    :returns: pairs (value, docID)
+    :rtype: list<tuple<int, int>>
+
+    """
+    postings = []
+    while pos < end and (limit is None or len(postings) < limit):
+        value, pos = readVarint(buf, pos)
+        docIDs, pos = readIncreasing(buf, pos)
+        postings += [(value, docID) for docID in docIDs]
+    return postings[:limit]
+
+
+def championsEnd(buf, pos, end, limit):
+    """
+    Function that finds the end of the groups of postings (see encodeTerm) that hold the first postings of a record, without decoding them.
+
+    :param buf: contents of the file or the record
+    :type buf: bytes or mmap
+    :param pos: position of the postings, as given by readHeader
+    :type pos: int
+    :param end: position of the positions, as given by readHeader
+    :type end: int
+    :param limit: number of postings
+    :type limit: int
+    :returns: position after the group of the last of those postings, None if the record doesn't have more postings than the limit
+    :rtype: int
+
+    """
+    count = 0
+    while pos < end:
+        value, pos = readVarint(buf, pos)
+        groupCount, pos = readVarint(buf, pos)
+        first, pos = readVarint(buf, pos)
+        if groupCount > 1:
+            pos += 1+buf[pos]*(groupCount-1)
+        count += groupCount
+        if count >= limit:
+            return pos if pos < end else None
+    return None
+
+
+def decodeGroups(buf, pos, end):
+    """
+    Generator that decodes the postings of a record by groups of postings with the same value, in the order they were written.
+
+    :param buf: contents of the file
+    :type buf: bytes or mmap
+    :param pos: position of the postings, as given by readHeader
+    :type pos: int
+    :param end: position of the positions, as given by readHeader
+    :type end: int
+    :returns: generator of pairs (value, docIDs of the group)
+    :rtype: generator<tuple<int, list<int>>>
+
+    """
+    while pos < end:
+        value, pos = readVarint(buf, pos)
+        docIDs, pos = readIncreasing(buf, pos)
+        yield value, docIDs
+
+
+def decodePositions(buf, pos, end):
+    """
+    Function that decodes the positions of a record, one list for each posting, in the same order as decodePostings.
+
+    :param buf: contents of the file
+    :type buf: bytes or mmap
+    :param pos: position of the positions, as given by readHeader
+    :type pos: int
+    :param end: position after the record, as given by readRecords
+    :type end: int
+    :returns: positions of each posting
+    :rtype: list<list<int>>
+
+    """
+    positions = []
+    while pos < end:
+        docPositions, pos = readIncreasing(buf, pos)
+        positions.append(docPositions)
+    return positions
+
+
+def isBinaryIndex(filename):
+    """
+    Function that tells if an index file was written in the binary format, by its magic number.
+
+    :param filename: name of the file
+    :type filename: str
+    :returns: True if the file is in the binary format
+    :rtype: bool
+
+    """
+    f = open(filename, "rb")
+    magic = f.read(len(BINMAGIC))
+    f.close()
+    return magic == BINMAGIC
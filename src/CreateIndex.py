@@ -9,15 +9,35 @@ import sys
 import psutil
 import gc
 import getopt
+import shutil
+import itertools
+import multiprocessing
+import threading
+import queue
+import collections
+import concurrent.futures
 
 import FileParser
 import Tokenizer
 import PersistIndex
 import Indexer
 import Merger
+import Lexicon
 #import IndexSplitter
 
 maxRAMused = (psutil.Process(os.getpid())).memory_info().rss
+# number of batches indexed between each verification of the real memory usage of the program
+RSSCHECKINTERVAL = 20
+# number of batches waiting to be tokenized, or being tokenized, per tokenizing process in the pipelined mode
+TOKENIZERBATCHES = 2
+# name of the intermediate indexes (blocks) written by the SPIMI
+AUXFILE = "intermediate_index_{0}.txt"
+# name of the folder where each build process writes its part of the index metadata and of the documents cache
+SHARDFOLDER = "intermediate_shard_{0}"
+# name of the intermediate indexes (runs) written by the multi-level merge, by level and number
+RUNFILE = "intermediate_run_{0}_{1}.txt"
+# maximum number of intermediate indexes merged at once by the multi-level merge, when only the number of processes is given
+MERGEFANIN = 16
 
 
 def main(argv):
@@ -30,7 +50,7 @@ def main(argv):
     """
 
     HELP = """USAGE:\n
-    python3 CreateIndex.py [-h] [-p] [-w] [-o outputFolder] [-l limit] [-t tokenizer] [-r limitRAM] inputFolder\n
+    python3 CreateIndex.py [-h] [-p] [-w] [-o outputFolder] [-l limit] [-t tokenizer] [-r limitRAM] [-j parserProcesses] [-b] [-c corpusCache] [-k cacheTerms] [-n buildProcesses] [-m tokenizerProcesses] [-v] [-z] [-s] [-i] [-g mergeFanIn] [-x mergeProcesses] [-e championsSize] inputFolder\n
         OPTIONS:
            h - shows this help
            o - define output file's folder
@@ -39,11 +59,32 @@ def main(argv):
            r - limit program execution to defined RAM capacity
            w - process weights of terms
            p - process positions of terms
+           j - parse several input files at the same time, in parallel processes
+           b - parse the input files with the byte scanner (faster than reading them line by line)
+           c - read the documents from a pre-parsed corpus cache, creating it first if it doesn't exist
+           k - define the number of best terms of each document kept in the documents cache (used by the Rocchio feedback)
+           n - build the index in several processes, each one indexing a part of the input files into its own blocks (used together with r)
+           m - pipeline the indexing: the documents are read by a thread, tokenized by several processes and indexed while the previous block is written in the background (used together with r)
+           v - calculate the weights in bulk, with NumPy, when each block is persisted instead of while each document is indexed (used together with w)
+           z - write the index in a compressed binary format instead of text
+           s - write the positions of the terms to their own file instead of after each posting, so the ranked retrieval doesn't read them (used together with p, the binary format already keeps them apart)
+           i - write the blocks (and the intermediate indexes of the multi-level merge) in the binary format, compressed with zlib, whatever the format of the final index (used together with r)
+           g - merge the blocks in several levels: groups of blocks are merged into larger intermediate indexes, in parallel processes, until they can be merged at once into the final index (used together with r)
+           x - define the number of processes of the multi-level merge (used together with r, implies g)
+           e - define the number of postings of the champions tier of each term, the ones read by the ranked retrieval for champions lists up to that size
         ARGUMENTS:
            outputFolder - actual name for the output folder
            limit - value for the number of lines limit
            tokenizer - must be simple(for the simple 2.1 tokenizer) or complex(for the more advanced 2.2 tokenizer)
            limitRAM - maximum RAM(in Gb) used in the indexing process
+           parserProcesses - maximum number of input files being parsed at the same time
+           corpusCache - name of the corpus cache file
+           cacheTerms - number of best terms per document, 0 to disable the documents cache
+           buildProcesses - number of processes building the index, the maximum RAM is shared between them
+           tokenizerProcesses - number of processes tokenizing the documents in the pipelined mode
+           mergeFanIn - maximum number of intermediate indexes merged at once, at least 2
+           mergeProcesses - number of processes merging groups of intermediate indexes at the same time, the number of CPUs by default
+           championsSize - number of postings of the champions tier of each term
            inputFolder - name of the folder that contains the input files to be processed"""
 
     # default variables
@@ -54,9 +95,22 @@ def main(argv):
     weightCalc = False
     positionCalc = False
     fileLimit = float("inf")
+    parserWorkers = None
+    byteScanner = False
+    corpusCache = None
+    cacheSize = Indexer.LIMITCACHE
+    buildWorkers = None
+    tokenizerWorkers = None
+    deferWeights = False
+    binaryFormat = False
+    separatePositions = False
+    compressBlocks = False
+    mergeFanIn = None
+    mergeWorkers = None
+    championsSize = Lexicon.CHAMPIONSTIER
 
     try:
-        opts, args = getopt.getopt(argv, "wpho:t:l:r:f:")
+        opts, args = getopt.getopt(argv, "wpbvzsiho:t:l:r:f:j:c:k:n:m:g:x:e:")
     except getopt.GetoptError:
         print(HELP)
         return 1
@@ -84,6 +138,46 @@ def main(argv):
             weightCalc = True
         elif opt == "-p":
             positionCalc = True
+        elif opt == "-j":
+            assert int(
+                arg) > 0, "Error: parserProcesses value must be a positive integer"
+            parserWorkers = int(arg)
+        elif opt == "-b":
+            byteScanner = True
+        elif opt == "-v":
+            deferWeights = True
+        elif opt == "-z":
+            binaryFormat = True
+        elif opt == "-s":
+            separatePositions = True
+        elif opt == "-i":
+            compressBlocks = True
+        elif opt == "-c":
+            corpusCache = arg
+        elif opt == "-k":
+            assert int(
+                arg) >= 0, "Error: cacheTerms value must be a non negative integer"
+            cacheSize = int(arg)
+        elif opt == "-n":
+            assert int(
+                arg) > 0, "Error: buildProcesses value must be a positive integer"
+            buildWorkers = int(arg)
+        elif opt == "-m":
+            assert int(
+                arg) > 0, "Error: tokenizerProcesses value must be a positive integer"
+            tokenizerWorkers = int(arg)
+        elif opt == "-g":
+            assert int(
+                arg) > 1, "Error: mergeFanIn value must be an integer greater than 1"
+            mergeFanIn = int(arg)
+        elif opt == "-x":
+            assert int(
+                arg) > 0, "Error: mergeProcesses value must be a positive integer"
+            mergeWorkers = int(arg)
+        elif opt == "-e":
+            assert int(
+                arg) > 0, "Error: championsSize value must be a positive integer"
+            championsSize = int(arg)
         elif opt == "-r":
             maxM = psutil.virtual_memory().free
             if arg != "":
@@ -99,23 +193,23 @@ def main(argv):
     if tokenizer == "simple":
         if maximumRAM is None:
             assignment1(Tokenizer.SimpleTokenizer(),
-                        outputFolder, args[0], limit, weightCalc, positionCalc, fileLimit)
+                        outputFolder, args[0], limit, weightCalc, positionCalc, fileLimit, parserWorkers, byteScanner, corpusCache, cacheSize, deferWeights, binaryFormat, separatePositions, championsSize)
         else:
             assignment2(Tokenizer.SimpleTokenizer(), outputFolder,
-                        args[0], limit, weightCalc, positionCalc, maximumRAM, fileLimit)
+                        args[0], limit, weightCalc, positionCalc, maximumRAM, fileLimit, parserWorkers, byteScanner, corpusCache, cacheSize, buildWorkers, tokenizerWorkers, deferWeights, binaryFormat, separatePositions, mergeFanIn, mergeWorkers, compressBlocks, championsSize)
 
     else:  # 'complex' = default tokenizer
         if maximumRAM is None:
             assignment1(Tokenizer.ComplexTokenizer(),
-                        outputFolder, args[0], limit, weightCalc, positionCalc, fileLimit)
+                        outputFolder, args[0], limit, weightCalc, positionCalc, fileLimit, parserWorkers, byteScanner, corpusCache, cacheSize, deferWeights, binaryFormat, separatePositions, championsSize)
         else:
             assignment2(Tokenizer.ComplexTokenizer(), outputFolder,
-                        args[0], limit, weightCalc, positionCalc, maximumRAM, fileLimit)
+                        args[0], limit, weightCalc, positionCalc, maximumRAM, fileLimit, parserWorkers, byteScanner, corpusCache, cacheSize, buildWorkers, tokenizerWorkers, deferWeights, binaryFormat, separatePositions, mergeFanIn, mergeWorkers, compressBlocks, championsSize)
 
     return 0
 
 
-def assignment1(tokenizer, outputFolder, inputFolder, limit, weightCalc, positionCalc, fileLimit):
+def assignment1(tokenizer, outputFolder, inputFolder, limit, weightCalc, positionCalc, fileLimit, parserWorkers=None, byteScanner=False, corpusCache=None, cacheSize=Indexer.LIMITCACHE, deferWeights=False, binaryFormat=False, separatePositions=False, championsSize=Lexicon.CHAMPIONSTIER):
     """
     Follows the execution flow specific for the first assignment.
 
@@ -131,36 +225,35 @@ def assignment1(tokenizer, outputFolder, inputFolder, limit, weightCalc, positio
     :type weightCalc: bool
     :param positionCalc: True if the term positions are to be calculated, False if not
     :type positionCalc: bool
+    :param parserWorkers: number of input files parsed at the same time, None to parse them sequentially
+    :type parserWorkers: int
+    :param byteScanner: True if the input files are to be parsed with the byte scanner
+    :type byteScanner: bool
+    :param corpusCache: name of the pre-parsed corpus cache file to be used, None to always parse the input files
+    :type corpusCache: str
+    :param cacheSize: number of best terms of each document kept in the documents cache
+    :type cacheSize: int
+    :param deferWeights: True if the weights are to be calculated in bulk, when the index is persisted
+    :type deferWeights: bool
+    :param binaryFormat: True if the index is to be written in the compressed binary format
+    :type binaryFormat: bool
+    :param separatePositions: True if the positions are to be written to their own file
+    :type separatePositions: bool
+    :param championsSize: number of postings of the champions tier of each term
+    :type championsSize: int
 
     """
 
-    parser = FileParser.LimitedRamFileParser(inputFolder, limit)
-    indexer = Indexer.FileIndexer(tokenizer, positionCalc, weightCalc, parser)
+    parser = createParser(inputFolder, limit, parserWorkers, byteScanner, corpusCache)
+    indexer = Indexer.FileIndexer(
+        tokenizer, positionCalc, weightCalc, parser, cacheSize, deferWeights)
 
-    run = True
-    while(run):
-        doc = parser.getContent()
-        if not doc:
-            run = False
-            break
-        indexer.createIndex(doc)
+    for batch in parser.getBatches():
+        indexer.indexBatch(batch)
 
-    if weightCalc and positionCalc:
-        persister = PersistIndex.PersistCSVWeightedPosition(
-            outputFolder, fileLimit, indexer, parser.numDocs)
-        persister.persist()
-    elif weightCalc:
-        persister = PersistIndex.PersistCSVWeighted(
-            outputFolder, fileLimit, indexer, parser.numDocs)
-        persister.persist()
-    elif positionCalc:
-        persister = PersistIndex.PersistCSVPosition(
-            outputFolder, fileLimit, indexer, parser.numDocs)
-        persister.persist()
-    else:
-        persister = PersistIndex.PersistCSV(
-            outputFolder, fileLimit, indexer, parser.numDocs)
-        persister.persist()
+    persister = createPersister(weightCalc, positionCalc, outputFolder, fileLimit,
+                                indexer, totalNumDocs=parser.numDocs, binaryFormat=binaryFormat, separatePositions=separatePositions, championsSize=championsSize)
+    persister.persist()
 
     if len(indexer.bestTerms.keys()) > 0:
         for key in indexer.bestTerms.keys():
@@ -179,7 +272,7 @@ def assignment1(tokenizer, outputFolder, inputFolder, limit, weightCalc, positio
     gc.collect()
 
 
-def assignment2(tokenizer, outputFolder, inputFolder, limit, weightCalc, positionCalc, maximumRAM, fileLimit):
+def assignment2(tokenizer, outputFolder, inputFolder, limit, weightCalc, positionCalc, maximumRAM, fileLimit, parserWorkers=None, byteScanner=False, corpusCache=None, cacheSize=Indexer.LIMITCACHE, buildWorkers=None, tokenizerWorkers=None, deferWeights=False, binaryFormat=False, separatePositions=False, mergeFanIn=None, mergeWorkers=None, compressBlocks=False, championsSize=Lexicon.CHAMPIONSTIER):
     """
     Follows the execution flow specific for the second assignment.
 
@@ -197,90 +290,712 @@ def assignment2(tokenizer, outputFolder, inputFolder, limit, weightCalc, positio
     :type positionCalc: bool
     :param maximumRAM: maximum amount of RAM (in Gb) allowed for the program execution
     :type maximumRAM: int
+    :param parserWorkers: number of input files parsed at the same time, None to parse them sequentially
+    :type parserWorkers: int
+    :param byteScanner: True if the input files are to be parsed with the byte scanner
+    :type byteScanner: bool
+    :param corpusCache: name of the pre-parsed corpus cache file to be used, None to always parse the input files
+    :type corpusCache: str
+    :param cacheSize: number of best terms of each document kept in the documents cache
+    :type cacheSize: int
+    :param buildWorkers: number of processes building the index, None to build it in this process
+    :type buildWorkers: int
+    :param tokenizerWorkers: number of tokenizing processes of the pipelined mode, None to index the documents without the pipeline
+    :type tokenizerWorkers: int
+    :param deferWeights: True if the weights are to be calculated in bulk, when each block is persisted
+    :type deferWeights: bool
+    :param binaryFormat: True if the intermediate and final indexes are to be written in the compressed binary format
+    :type binaryFormat: bool
+    :param separatePositions: True if the positions of the final index are to be written to their own file
+    :type separatePositions: bool
+    :param mergeFanIn: maximum number of intermediate indexes merged at once, None to merge all the blocks at once unless mergeWorkers is given
+    :type mergeFanIn: int
+    :param mergeWorkers: number of processes of the multi-level merge, None to use the number of CPUs
+    :type mergeWorkers: int
+    :param compressBlocks: True if the intermediate indexes are to be written in the binary format, compressed with zlib
+    :type compressBlocks: bool
+    :param championsSize: number of postings of the champions tier of each term
+    :type championsSize: int
 
     """
 
-    parser = FileParser.LimitedRamFileParser(inputFolder, limit)
+    indexer = Indexer.FileIndexer(
+        tokenizer, positionCalc, weightCalc, cacheSize=cacheSize, deferWeights=deferWeights)
+    persister = createPersister(
+        weightCalc, positionCalc, outputFolder, fileLimit, indexer, binaryFormat=binaryFormat, separatePositions=separatePositions, compressBlocks=compressBlocks, championsSize=championsSize)
 
-    indexer = Indexer.FileIndexer(tokenizer, positionCalc, weightCalc)
-    if weightCalc and positionCalc:
-        persister = PersistIndex.PersistCSVWeightedPosition(
-            outputFolder, fileLimit, indexer)
-    elif weightCalc:
-        persister = PersistIndex.PersistCSVWeighted(
-            outputFolder, fileLimit, indexer)
-    elif positionCalc:
-        persister = PersistIndex.PersistCSVPosition(
-            outputFolder, fileLimit, indexer)
+    if buildWorkers and buildWorkers > 1:
+        blocks, numDocs = buildShards(persister, tokenizer, inputFolder, limit, weightCalc, positionCalc,
+                                      maximumRAM, fileLimit, byteScanner, corpusCache, cacheSize, buildWorkers, deferWeights, binaryFormat, compressBlocks)
     else:
-        persister = PersistIndex.PersistCSV(outputFolder, fileLimit, indexer)
+        parser = createParser(inputFolder, limit,
+                              parserWorkers, byteScanner, corpusCache)
+        if tokenizerWorkers:
+            blocks = indexBlocksPipelined(
+                parser, indexer, persister, maximumRAM, itertools.count(1), tokenizerWorkers)
+        else:
+            blocks = indexBlocks(parser, indexer, persister,
+                                 maximumRAM, itertools.count(1))
+        numDocs = parser.numDocs
+        parser.clearVar()
+        del parser
+    persister.close()
+
+    # an empty list means that the whole index fit in a single block, already persisted as the final index
+    if blocks == []:
+        return 0
 
-    auxFile = "intermediate_index_{0}.txt"
-    blockCounter = 1
+    # merging intermediateIndexes
+    tokenizer.clearVar()
+    indexer.clearVar()
+    persister.clearVar()
+    del tokenizer
+    del persister
+
+    if mergeFanIn or mergeWorkers:
+        blocks = mergeRuns(weightCalc, positionCalc, blocks, numDocs,
+                           mergeFanIn if mergeFanIn else MERGEFANIN, mergeWorkers, binaryFormat, compressBlocks)
+    merger = createMerger(weightCalc, positionCalc, blocks,
+                          numDocs, outputFolder, fileLimit, binaryFormat, separatePositions, compressBlocks=compressBlocks, championsSize=championsSize)
+
+    print("Merging...")
+    merger.merge()
+
+    del merger
+
+
+def mergeRuns(weightCalc, positionCalc, blocks, numDocs, fanIn, mergeWorkers=None, binaryFormat=False, compressBlocks=False):
+    """
+    Auxiliary function that merges the intermediate indexes in several levels, until at most fanIn are left to be merged into the final index.
+    In each level, the intermediate indexes are split in consecutive groups of fanIn (so the postings with the same value keep their order) and each group is merged into a new intermediate index (a run) by a pool of processes; a group of a single one is kept as it is.
+    Each process has at most fanIn+1 files open, whatever the number of blocks.
 
-    # getContent() in this context(with LimitedParser) returns 1 document
+    :param weightCalc: True if the term weights were calculated, False if not
+    :type weightCalc: bool
+    :param positionCalc: True if the term positions were calculated, False if not
+    :type positionCalc: bool
+    :param blocks: names of the intermediate indexes to be merged
+    :type blocks: list<str>
+    :param numDocs: total number of documents, used to calculate the idf of the terms
+    :type numDocs: int
+    :param fanIn: maximum number of intermediate indexes merged at once
+    :type fanIn: int
+    :param mergeWorkers: number of processes merging groups at the same time, None to use the number of CPUs
+    :type mergeWorkers: int
+    :param binaryFormat: True if the intermediate indexes were written in the compressed binary format
+    :type binaryFormat: bool
+    :param compressBlocks: True if the intermediate indexes were written in the binary format, compressed with zlib
+    :type compressBlocks: bool
+    :returns: names of the intermediate indexes left, at most fanIn
+    :rtype: list<str>
+
+    """
+    level = 0
+    while len(blocks) > fanIn:
+        groups = [blocks[i:i+fanIn] for i in range(0, len(blocks), fanIn)]
+        print("Merging level "+str(level)+" ("+str(len(blocks))+" intermediate indexes)...")
+        pool = multiprocessing.Pool(
+            min(mergeWorkers if mergeWorkers else os.cpu_count(), len(groups)))
+        blocks = pool.starmap(mergeRun, [(weightCalc, positionCalc, group, numDocs, RUNFILE.format(
+            level, number), binaryFormat, compressBlocks) for number, group in enumerate(groups)])
+        pool.close()
+        pool.join()
+        level += 1
+    return blocks
+
+
+def mergeRun(weightCalc, positionCalc, blocks, numDocs, runFile, binaryFormat=False, compressBlocks=False):
+    """
+    Auxiliary function, run by the processes of the multi-level merge, that merges a group of intermediate indexes into a new one, in their format.
+    As in the final merge, the memory used doesn't depend on the size of the run.
+
+    :param weightCalc: True if the term weights were calculated, False if not
+    :type weightCalc: bool
+    :param positionCalc: True if the term positions were calculated, False if not
+    :type positionCalc: bool
+    :param blocks: names of the intermediate indexes to be merged, which are removed
+    :type blocks: list<str>
+    :param numDocs: total number of documents
+    :type numDocs: int
+    :param runFile: name of the new intermediate index
+    :type runFile: str
+    :param binaryFormat: True if the intermediate indexes were written in the compressed binary format
+    :type binaryFormat: bool
+    :param compressBlocks: True if the intermediate indexes were written in the binary format, compressed with zlib
+    :type compressBlocks: bool
+    :returns: name of the new intermediate index (the one of the group if it had a single one)
+    :rtype: str
+
+    """
+    if len(blocks) == 1:
+        return blocks[0]
+    merger = createMerger(weightCalc, positionCalc, blocks,
+                          numDocs, ".", float("inf"), binaryFormat, runFile=runFile, compressBlocks=compressBlocks)
+    merger.merge()
+    return runFile
+
+
+def indexBlocks(parser, indexer, persister, maximumRAM, blockNumbers, persistFinal=True):
+    """
+    Auxiliary function that runs the SPIMI over the documents of a parser: the batches of documents are indexed until the memory for the block is exhausted and then the block is persisted as an intermediate index, together with its part of the index metadata and of the documents cache.
+
+    :param parser: parser that hands out the documents to be indexed
+    :type parser: FileParser
+    :param indexer: indexer used to build each block, its docID must be the one before the first document of the parser
+    :type indexer: Indexer
+    :param persister: persister used to write the blocks, the index metadata and the documents cache
+    :type persister: PersistIndex
+    :param maximumRAM: maximum amount of RAM (in bytes) allowed for this process
+    :type maximumRAM: int
+    :param blockNumbers: numbers used to name the intermediate indexes, in order
+    :type blockNumbers: iterator<int>
+    :param persistFinal: True if an index that fits in a single block is to be persisted directly into the output folder
+    :type persistFinal: bool
+    :returns: names of the intermediate indexes written, in order, empty if nothing was written or if the final index was persisted directly
+    :rtype: list<str>
+
+    """
+    # the memory for the blocks is what remains after the program's own usage, the blocks' size is estimated by the indexer
+    blockMemory = int(maximumRAM*0.85) - process.memory_info().rss
+    numBatches = 0
+    blocks = []
+
+    # getBatches() returns a generator of batches of documents, the memory is verified between batches
+    batches = parser.getBatches()
     runSPIMI = True
     while(runSPIMI):
-        while(isMemoryAvailable(maximumRAM)):
-            doc = parser.getContent()
-            if not doc:
+        # each block gets at least one batch
+        while True:
+            batch = next(batches, None)
+            if batch is None:
                 runSPIMI = False
                 break
-            indexer.createIndex(doc)
+            indexer.indexBatch(batch)
+            numBatches += 1
+            if indexer.estimateMemory() >= blockMemory:
+                break
+            # the real usage is only verified once in a while, as a safety net for what the estimate doesn't account
+            if numBatches % RSSCHECKINTERVAL == 0 and not isMemoryAvailable(maximumRAM):
+                break
 
+        # the terms are taken first, since the deferred weights (including the ones of the best terms) are calculated then
+        index = indexer.items()
         persister.setTotalNumDocs(parser.numDocs)
         persister.persistTranslations(
             sorted(indexer.translation, key=lambda tup: tup[0]))
         if len(indexer.bestTerms.keys()) > 0:
             for key in indexer.bestTerms.keys():
                 persister.persistCache(key, indexer.bestTerms[key])
-        if not runSPIMI and blockCounter == 1:
-            persister.persist(indexer.index)
-            return 0
-        else:
-            if persister.persist(indexer.index, auxFile.format(blockCounter)):
-                blockCounter += 1
+        if persistFinal and not runSPIMI and blocks == []:
+            persister.persist(index)
+            return blocks
+        blockFile = AUXFILE.format(next(blockNumbers))
+        if persister.persist(index, blockFile):
+            blocks.append(blockFile)
         indexer.clearVar()
         persister.clearVar()
-        tokenizer.clearTokens()
         gc.collect()
 
-    if weightCalc and positionCalc:
-        merger = Merger.PositionWeightMerger(
-            [auxFile.format(x) for x in range(1, blockCounter)], parser.numDocs, outputFolder, fileLimit)
+    return blocks
+
+
+def indexBlocksPipelined(parser, indexer, persister, maximumRAM, blockNumbers, tokenizerWorkers, persistFinal=True):
+    """
+    Auxiliary function that runs the same SPIMI as indexBlocks, but with its stages overlapped: a thread reads the batches of documents from the parser, a pool of processes tokenizes them and this thread indexes the tokens, while the previous block is written by a background thread.
+    Every stage can only get a bounded number of batches ahead of the next one, so the memory usage stays bounded.
+
+    :param parser: parser that hands out the documents to be indexed
+    :type parser: FileParser
+    :param indexer: indexer used to build each block, its docID must be the one before the first document of the parser
+    :type indexer: Indexer
+    :param persister: persister used to write the blocks, the index metadata and the documents cache
+    :type persister: PersistIndex
+    :param maximumRAM: maximum amount of RAM (in bytes) allowed for this process
+    :type maximumRAM: int
+    :param blockNumbers: numbers used to name the intermediate indexes, in order
+    :type blockNumbers: iterator<int>
+    :param tokenizerWorkers: number of tokenizing processes
+    :type tokenizerWorkers: int
+    :param persistFinal: True if an index that fits in a single block is to be persisted directly into the output folder
+    :type persistFinal: bool
+    :returns: names of the intermediate indexes written, in order, empty if nothing was written or if the final index was persisted directly
+    :rtype: list<str>
+
+    """
+    # two blocks can be in memory at the same time: the one being indexed and the one being written
+    blockMemory = (int(maximumRAM*0.85) - process.memory_info().rss)//2
+    numBatches = 0
+    blocks = []
+
+    batchQueue = queue.Queue(FileParser.QUEUESIZE)
+    reader = threading.Thread(target=readBatches, args=(
+        parser, batchQueue), daemon=True)
+    reader.start()
+    pool = multiprocessing.Pool(
+        tokenizerWorkers, Tokenizer.initWorker, (indexer.tokenizer,))
+    writer = concurrent.futures.ThreadPoolExecutor(1)
+    writing = None
+    # batches sent to the tokenizing processes, in order, with the pending result of their tokenization
+    pending = collections.deque()
+    readDone = False
+
+    try:
+        runSPIMI = True
+        while(runSPIMI):
+            # each block gets at least one batch
+            while True:
+                while not readDone and len(pending) < tokenizerWorkers*TOKENIZERBATCHES:
+                    batch = batchQueue.get()
+                    if batch is None:
+                        readDone = True
+                    elif isinstance(batch, Exception):
+                        raise batch
+                    else:
+                        pending.append((batch, pool.apply_async(Tokenizer.tokenizeWorker, ([
+                            docContent for docPMID, docContent in batch],))))
+                if len(pending) == 0:
+                    runSPIMI = False
+                    break
+                batch, tokensList = pending.popleft()
+                indexer.indexBatch(batch, [tokens.split(
+                    " ") if tokens else [] for tokens in tokensList.get()])
+                numBatches += 1
+                if indexer.estimateMemory() >= blockMemory:
+                    break
+                # the real usage is only verified once in a while, as a safety net for what the estimate doesn't account
+                if numBatches % RSSCHECKINTERVAL == 0 and not isMemoryAvailable(maximumRAM):
+                    break
+
+            # the terms are taken first, since the deferred weights (including the ones of the best terms) are calculated then
+            index = indexer.items()
+            persister.persistTranslations(
+                sorted(indexer.translation, key=lambda tup: tup[0]))
+            if len(indexer.bestTerms.keys()) > 0:
+                for key in indexer.bestTerms.keys():
+                    persister.persistCache(key, indexer.bestTerms[key])
+            if persistFinal and not runSPIMI and blocks == []:
+                persister.setTotalNumDocs(parser.numDocs)
+                persister.persist(index)
+                return blocks
+            # the previous block must be on disk before the next one is handed to the writer
+            if writing:
+                writing.result()
+                writing = None
+            if indexer.index != []:
+                blocks.append(AUXFILE.format(next(blockNumbers)))
+                writing = writer.submit(
+                    writeBlock, persister, index, blocks[-1])
+            indexer.clearVar()
+            gc.collect()
+
+        if writing:
+            writing.result()
+    finally:
+        pool.terminate()
+        writer.shutdown()
+
+    return blocks
+
+
+def readBatches(parser, batchQueue):
+    """
+    Function executed by the reader thread of indexBlocksPipelined, which puts the batches of documents of the parser in the queue, followed by None.
+    If the parser fails, the exception is put in the queue instead, to be raised by the indexing thread.
+
+    :param parser: parser that hands out the documents to be indexed
+    :type parser: FileParser
+    :param batchQueue: bounded queue shared with the indexing thread
+    :type batchQueue: queue.Queue
+
+    """
+    try:
+        for batch in parser.getBatches():
+            batchQueue.put(batch)
+        batchQueue.put(None)
+    except Exception as e:
+        batchQueue.put(e)
+
+
+def writeBlock(persister, index, blockFile):
+    """
+    Function executed by the writer thread of indexBlocksPipelined, which persists one block as an intermediate index.
+
+    :param persister: persister used to write the block
+    :type persister: PersistIndex
+    :param index: pairs (term, postings) of the block, as returned by Indexer.items()
+    :type index: list<tuple<str, Postings>>
+    :param blockFile: name of the intermediate index
+    :type blockFile: str
+    :returns: True if the block was written
+    :rtype: bool
+
+    """
+    written = persister.persist(index, blockFile)
+    persister.clearVar()
+    return written
+
+
+def buildShards(persister, tokenizer, inputFolder, limit, weightCalc, positionCalc, maximumRAM, fileLimit, byteScanner=False, corpusCache=None, cacheSize=Indexer.LIMITCACHE, buildWorkers=None, deferWeights=False, binaryFormat=False, compressBlocks=False):
+    """
+    Auxiliary function that builds the intermediate indexes in several processes, each one indexing a shard of the input: consecutive input files or, when a corpus cache is used, a range of its documents.
+    The documents of every shard are counted first, so that each process gets the range of internal docIDs that the sequential execution would give to its documents. The index metadata and the documents cache written by each process are then appended, in order, to the ones of the persister.
+
+    :param persister: persister whose index metadata and documents cache files receive the ones of the processes
+    :type persister: PersistIndex
+    :param tokenizer: class instance to be used in the tokenization process, a copy is sent to each process
+    :type tokenizer: Tokenizer
+    :param inputFolder: name of the folder that contains the files to be indexed
+    :type inputFolder: str
+    :param limit: limit number of documents to have in consideration, None if no limit
+    :type limit: int
+    :param weightCalc: True if the term weights are to be calculated, False if not
+    :type weightCalc: bool
+    :param positionCalc: True if the term positions are to be calculated, False if not
+    :type positionCalc: bool
+    :param maximumRAM: maximum amount of RAM (in bytes) allowed for the program execution, shared equally by the processes
+    :type maximumRAM: int
+    :param byteScanner: True if the input files are to be parsed with the byte scanner
+    :type byteScanner: bool
+    :param corpusCache: name of the pre-parsed corpus cache file to be used, None to parse the input files
+    :type corpusCache: str
+    :param cacheSize: number of best terms of each document kept in the documents cache
+    :type cacheSize: int
+    :param buildWorkers: maximum number of processes building the index, None to use the number of available cores
+    :type buildWorkers: int
+    :param deferWeights: True if the weights are to be calculated in bulk, when each block is persisted
+    :type deferWeights: bool
+    :param binaryFormat: True if the intermediate indexes are to be written in the compressed binary format
+    :type binaryFormat: bool
+    :param compressBlocks: True if the intermediate indexes are to be written in the binary format, compressed with zlib
+    :type compressBlocks: bool
+    :returns: names of the intermediate indexes written, in the order of their documents, and the number of documents read
+    :rtype: tuple<list<str>, int>
+
+    """
+    if not buildWorkers:
+        buildWorkers = os.cpu_count()
+    if corpusCache:
+        createCorpusCache(inputFolder, corpusCache, byteScanner=byteScanner)
+        numRecords = FileParser.corpusCacheLength(corpusCache)
+        step = max(1, -(-numRecords // buildWorkers))
+        shards = [(start, min(start+step, numRecords))
+                  for start in range(0, numRecords, step)]
+    else:
+        shards = splitFiles(
+            [inputFolder+"/"+f for f in sorted(os.listdir(inputFolder))], buildWorkers)
+    if shards == []:
+        return [], 0
+
+    pool = multiprocessing.Pool(len(shards))
+    print("Counting...")
+    counts = pool.starmap(
+        countShard, [(inputFolder, shard, corpusCache) for shard in shards])
+
+    # like the parsers, the document that reaches the limit isn't read, but it's counted
+    remaining = limit-1 if limit else float("inf")
+    numDocs = min(sum(c[0] for c in counts), limit if limit else float("inf"))
+    firstDocID = 1
+    ranges = []
+    for shard, (numRecords, numDocuments) in zip(shards, counts):
+        if numRecords > remaining:
+            numRecords, numDocuments = countShard(
+                inputFolder, shard, corpusCache, remaining)
+        if numRecords > 0:
+            ranges.append((shard, numRecords, firstDocID))
+        remaining -= numRecords
+        firstDocID += numDocuments
+    if ranges == []:
+        pool.close()
+        return [], numDocs
+    # the memory left by this process is shared equally and the block numbers are interleaved, so every process can name its blocks independently
+    memoryShare = (maximumRAM - process.memory_info().rss)/len(ranges)
+    results = pool.starmap(buildShard, [(tokenizer, inputFolder, shard, numRecords, firstDocID, weightCalc, positionCalc, memoryShare,
+                                         fileLimit, byteScanner, corpusCache, cacheSize, shardNumber, len(ranges), deferWeights, binaryFormat, compressBlocks) for shardNumber, (shard, numRecords, firstDocID) in enumerate(ranges)])
+    pool.close()
+    pool.join()
+
+    blocks = []
+    for shardNumber, shardBlocks in enumerate(results):
+        blocks += shardBlocks
+        shardFolder = SHARDFOLDER.format(shardNumber)
+        for filename, out in (("indexMetadata.txt", persister.translationFile), ("docCache", persister.cacheFile)):
+            f = open(shardFolder+"/"+filename, "r")
+            shutil.copyfileobj(f, out)
+            f.close()
+        shutil.rmtree(shardFolder)
+    return blocks, numDocs
+
+
+def buildShard(tokenizer, inputFolder, shard, numRecords, firstDocID, weightCalc, positionCalc, maximumRAM, fileLimit, byteScanner, corpusCache, cacheSize, shardNumber, numShards, deferWeights=False, binaryFormat=False, compressBlocks=False):
+    """
+    Function executed by each of the processes started by buildShards, which runs the SPIMI over the documents of one shard.
+    The index metadata and the documents cache of the shard are written to its own folder, named after SHARDFOLDER.
+
+    :param tokenizer: class instance to be used in the tokenization process
+    :type tokenizer: Tokenizer
+    :param inputFolder: name of the folder that contains the files to be indexed
+    :type inputFolder: str
+    :param shard: names of the input files of the shard or, when a corpus cache is used, range of its documents
+    :type shard: list<str> or tuple<int, int>
+    :param numRecords: number of documents of the shard to be read
+    :type numRecords: int
+    :param firstDocID: internal docID of the first document of the shard with content
+    :type firstDocID: int
+    :param weightCalc: True if the term weights are to be calculated, False if not
+    :type weightCalc: bool
+    :param positionCalc: True if the term positions are to be calculated, False if not
+    :type positionCalc: bool
+    :param maximumRAM: amount of RAM (in bytes) this process can use besides what it already uses when it starts
+    :type maximumRAM: int
+    :param byteScanner: True if the input files are to be parsed with the byte scanner
+    :type byteScanner: bool
+    :param corpusCache: name of the pre-parsed corpus cache file to be used, None to parse the input files
+    :type corpusCache: str
+    :param cacheSize: number of best terms of each document kept in the documents cache
+    :type cacheSize: int
+    :param shardNumber: position of the shard, starting at 0
+    :type shardNumber: int
+    :param numShards: number of shards being indexed
+    :type numShards: int
+    :param deferWeights: True if the weights are to be calculated in bulk, when each block is persisted
+    :type deferWeights: bool
+    :param binaryFormat: True if the intermediate indexes are to be written in the compressed binary format
+    :type binaryFormat: bool
+    :param compressBlocks: True if the intermediate indexes are to be written in the binary format, compressed with zlib
+    :type compressBlocks: bool
+    :returns: names of the intermediate indexes written, in order
+    :rtype: list<str>
+
+    """
+    global process
+    process = psutil.Process(os.getpid())
+    maximumRAM += process.memory_info().rss
+
+    # the parsers stop when the document count reaches the limit, without reading that document
+    parser = createShardParser(
+        inputFolder, shard, numRecords+1, byteScanner, corpusCache)
+    indexer = Indexer.FileIndexer(
+        tokenizer, positionCalc, weightCalc, cacheSize=cacheSize, deferWeights=deferWeights)
+    indexer.docID = firstDocID-1
+    shardFolder = SHARDFOLDER.format(shardNumber)
+    persister = createPersister(weightCalc, positionCalc, shardFolder, fileLimit, indexer,
+                                shardFolder+"/indexMetadata.txt", shardFolder+"/docCache", binaryFormat=binaryFormat, compressBlocks=compressBlocks)
+
+    blocks = indexBlocks(parser, indexer, persister, maximumRAM,
+                         itertools.count(shardNumber+1, numShards), False)
+    persister.close()
+    parser.clearVar()
+    return blocks
+
+
+def countShard(inputFolder, shard, corpusCache=None, maxRecords=None):
+    """
+    Auxiliary function that counts the documents of a shard, as defined in buildShard.
+
+    :param inputFolder: name of the folder that contains the files to be indexed
+    :type inputFolder: str
+    :param shard: names of the input files of the shard or, when a corpus cache is used, range of its documents
+    :type shard: list<str> or tuple<int, int>
+    :param corpusCache: name of the pre-parsed corpus cache file to be used, None to parse the input files
+    :type corpusCache: str
+    :param maxRecords: maximum number of documents to be read, None to read them all
+    :type maxRecords: int
+    :returns: number of documents read and number of those that have content
+    :rtype: tuple<int, int>
+
+    """
+    # the byte scanner finds the same documents as the line by line reader, only faster
+    parser = createShardParser(inputFolder, shard, None, True, corpusCache)
+    counts = FileParser.countDocuments(parser.records, maxRecords)
+    parser.clearVar()
+    return counts
+
+
+def splitFiles(files, numShards):
+    """
+    Auxiliary function that splits a list of files into at most numShards groups of consecutive files, with similar total sizes.
+
+    :param files: names of the files to be split
+    :type files: list<str>
+    :param numShards: maximum number of groups
+    :type numShards: int
+    :returns: the groups of files, in order
+    :rtype: list<list<str>>
+
+    """
+    sizes = [os.path.getsize(f) for f in files]
+    totalSize = sum(sizes)
+    shards = []
+    accumulated = 0
+    for f, size in zip(files, sizes):
+        if shards == [] or accumulated >= totalSize*len(shards)/numShards:
+            shards.append([])
+        shards[-1].append(f)
+        accumulated += size
+    return shards
+
+
+def createPersister(weightCalc, positionCalc, outputFolder, fileLimit, indexer=None, translationFilename=None, cacheFilename=None, totalNumDocs=1, binaryFormat=False, separatePositions=False, compressBlocks=False, championsSize=Lexicon.CHAMPIONSTIER):
+    """
+    Auxiliary function that creates the persister adequate to the options passed to the program.
+
+    :param weightCalc: True if the term weights are to be calculated, False if not
+    :type weightCalc: bool
+    :param positionCalc: True if the term positions are to be calculated, False if not
+    :type positionCalc: bool
+    :param outputFolder: name of the folder where the final index will be written to
+    :type outputFolder: str
+    :param indexer: instance of the indexer whose index is persisted
+    :type indexer: Indexer
+    :param translationFilename: name of the index metadata file, None for the default one
+    :type translationFilename: str
+    :param cacheFilename: name of the documents cache file, None for the default one
+    :type cacheFilename: str
+    :param totalNumDocs: total number of documents, used to calculate the idf of the terms
+    :type totalNumDocs: int
+    :param binaryFormat: True if the index is to be written in the compressed binary format
+    :type binaryFormat: bool
+    :param separatePositions: True if the positions of the final index are to be written to their own file (only for the text format with positions)
+    :type separatePositions: bool
+    :param compressBlocks: True if the intermediate indexes are to be written in the binary format, compressed with zlib
+    :type compressBlocks: bool
+    :param championsSize: number of postings of the champions tier of each term
+    :type championsSize: int
+    :returns: the persister instance
+    :rtype: PersistIndex
+
+    """
+    if binaryFormat and weightCalc and positionCalc:
+        persisterClass = PersistIndex.PersistBinaryWeightedPosition
+    elif binaryFormat and weightCalc:
+        persisterClass = PersistIndex.PersistBinaryWeighted
+    elif binaryFormat and positionCalc:
+        persisterClass = PersistIndex.PersistBinaryPosition
+    elif binaryFormat:
+        persisterClass = PersistIndex.PersistBinary
+    elif weightCalc and positionCalc:
+        return PersistIndex.PersistCSVWeightedPosition(outputFolder, fileLimit, indexer, totalNumDocs, translationFilename, cacheFilename, separatePositions, compressBlocks, championsSize)
     elif weightCalc:
-        merger = Merger.WeightMerger(
-            [auxFile.format(x) for x in range(1, blockCounter)], parser.numDocs, outputFolder, fileLimit)
+        persisterClass = PersistIndex.PersistCSVWeighted
     elif positionCalc:
-        merger = Merger.PositionMerger(
-            [auxFile.format(x) for x in range(1, blockCounter)], parser.numDocs, outputFolder, fileLimit)
+        return PersistIndex.PersistCSVPosition(outputFolder, fileLimit, indexer, totalNumDocs, translationFilename, cacheFilename, separatePositions, compressBlocks, championsSize)
     else:
-        merger = Merger.SimpleMerger(
-            [auxFile.format(x) for x in range(1, blockCounter)], parser.numDocs, outputFolder, fileLimit)
+        persisterClass = PersistIndex.PersistCSV
+    return persisterClass(outputFolder, fileLimit, indexer, totalNumDocs, translationFilename, cacheFilename, compressBlocks=compressBlocks, championsSize=championsSize)
 
-    # merging intermediateIndexes
-    tokenizer.clearVar()
-    parser.clearVar()
-    indexer.clearVar()
-    persister.clearVar()
-    del parser
-    del tokenizer
-    del persister
 
-    runSPIMI = True
-    allDone = False
-    print("Merging...")
-    while(runSPIMI):
-        while not allDone and isMemoryAvailable(maximumRAM):
-            allDone = merger.mergeIndex()
-            if allDone:
-                runSPIMI = False
-                merger.writeIndex()
-                break
-        merger.writeIndex()
-        gc.collect()
+def createMerger(weightCalc, positionCalc, blocks, numDocs, outputFolder, fileLimit, binaryFormat=False, separatePositions=False, runFile=None, compressBlocks=False, championsSize=Lexicon.CHAMPIONSTIER):
+    """
+    Auxiliary function that creates the merger adequate to the options passed to the program.
 
-    del merger
+    :param weightCalc: True if the term weights were calculated, False if not
+    :type weightCalc: bool
+    :param positionCalc: True if the term positions were calculated, False if not
+    :type positionCalc: bool
+    :param blocks: names of the intermediate indexes to be merged
+    :type blocks: list<str>
+    :param numDocs: total number of documents, used to calculate the idf of the terms
+    :type numDocs: int
+    :param outputFolder: name of the folder where the final index will be written to
+    :type outputFolder: str
+    :param binaryFormat: True if the intermediate indexes were written in the compressed binary format
+    :type binaryFormat: bool
+    :param separatePositions: True if the positions of the final index are to be written to their own file (only for the text format with positions)
+    :type separatePositions: bool
+    :param runFile: name of the intermediate index written instead of the final index, by the multi-level merge
+    :type runFile: str
+    :param compressBlocks: True if the intermediate indexes were written in the binary format, compressed with zlib
+    :type compressBlocks: bool
+    :param championsSize: number of postings of the champions tier of each term
+    :type championsSize: int
+    :returns: the merger instance
+    :rtype: Merger
+
+    """
+    # the intermediate indexes of the multi-level merge are written in the format of the blocks
+    if binaryFormat or (compressBlocks and runFile):
+        return Merger.BinaryMerger(blocks, numDocs, outputFolder, fileLimit, runFile=runFile, championsSize=championsSize)
+    if compressBlocks:
+        return Merger.CSVBlockMerger(blocks, numDocs, outputFolder, fileLimit, separatePositions and positionCalc, championsSize)
+    if weightCalc and positionCalc:
+        return Merger.PositionWeightMerger(blocks, numDocs, outputFolder, fileLimit, separatePositions, runFile, championsSize)
+    if weightCalc:
+        return Merger.WeightMerger(blocks, numDocs, outputFolder, fileLimit, runFile=runFile, championsSize=championsSize)
+    if positionCalc:
+        return Merger.PositionMerger(blocks, numDocs, outputFolder, fileLimit, separatePositions, runFile, championsSize)
+    return Merger.SimpleMerger(blocks, numDocs, outputFolder, fileLimit, runFile=runFile, championsSize=championsSize)
+
+
+def createParser(inputFolder, limit, parserWorkers=None, byteScanner=False, corpusCache=None):
+    """
+    Auxiliary function that creates the file parser adequate to the options passed to the program.
+
+    :param inputFolder: name of the folder that contains the files to be processed
+    :type inputFolder: str
+    :param limit: limit number of documents to have in consideration, None if no limit
+    :type limit: int
+    :param parserWorkers: number of input files parsed at the same time, None to parse them sequentially
+    :type parserWorkers: int
+    :param byteScanner: True if the input files are to be parsed with the byte scanner
+    :type byteScanner: bool
+    :param corpusCache: name of the pre-parsed corpus cache file, created from the input files if it doesn't exist yet
+    :type corpusCache: str
+    :returns: the parser instance
+    :rtype: FileParser
+
+    """
+    if corpusCache:
+        createCorpusCache(inputFolder, corpusCache, parserWorkers, byteScanner)
+        return FileParser.CachedFileParser(inputFolder, limit, corpusCache)
+    if parserWorkers:
+        return FileParser.ParallelFileParser(inputFolder, limit, parserWorkers, byteScanner=byteScanner)
+    return FileParser.LimitedRamFileParser(inputFolder, limit, byteScanner)
+
+
+def createShardParser(inputFolder, shard, limit, byteScanner=False, corpusCache=None):
+    """
+    Auxiliary function that creates the file parser for a shard of the input, as defined in buildShard.
+
+    :param inputFolder: name of the folder that contains the files to be processed
+    :type inputFolder: str
+    :param shard: names of the input files of the shard or, when a corpus cache is used, range of its documents
+    :type shard: list<str> or tuple<int, int>
+    :param limit: limit number of documents to have in consideration, None if no limit
+    :type limit: int
+    :param byteScanner: True if the input files are to be parsed with the byte scanner
+    :type byteScanner: bool
+    :param corpusCache: name of the pre-parsed corpus cache file, None to parse the input files
+    :type corpusCache: str
+    :returns: the parser instance
+    :rtype: FileParser
+
+    """
+    if corpusCache:
+        return FileParser.CachedFileParser(inputFolder, limit, corpusCache, shard[0], shard[1])
+    return FileParser.LimitedRamFileParser(inputFolder, limit, byteScanner, shard)
+
+
+def createCorpusCache(inputFolder, corpusCache, parserWorkers=None, byteScanner=False):
+    """
+    Auxiliary function that writes the corpus cache with every document of the input files, if it doesn't exist yet.
+
+    :param inputFolder: name of the folder that contains the files to be processed
+    :type inputFolder: str
+    :param corpusCache: name of the pre-parsed corpus cache file
+    :type corpusCache: str
+    :param parserWorkers: number of input files parsed at the same time, None to parse them sequentially
+    :type parserWorkers: int
+    :param byteScanner: True if the input files are to be parsed with the byte scanner
+    :type byteScanner: bool
+
+    """
+    if not os.path.exists(corpusCache):
+        print("Caching corpus...")
+        # the whole corpus is cached, so that the same cache serves any documents limit
+        parser = createParser(inputFolder, None, parserWorkers, byteScanner)
+        FileParser.writeCorpusCache(parser.records, corpusCache+".tmp")
+        os.replace(corpusCache+".tmp", corpusCache)
+        parser.clearVar()
 
 
 def isMemoryAvailable(maximumRAM):
@@ -9,6 +9,249 @@ from abc import ABC, abstractmethod
 import gzip
 import io
 import os
+import mmap
+import struct
+import multiprocessing
+from array import array
+
+# number of documents sent at once from a parsing process to the main process
+BATCHSIZE = 1000
+# number of batches each parsing process can have waiting before it blocks
+QUEUESIZE = 4
+# number of decompressed bytes read at once by the byte scanner
+SCANBLOCKSIZE = 4*1024*1024
+# identifies the files written by writeCorpusCache
+CACHEMAGIC = b"RICORPUS1"
+# header of each record in the corpus cache: length of the PMID and length of the content, in bytes
+RECORDHEADER = struct.Struct("<II")
+# footer of the corpus cache: position of the offsets table and number of records
+CACHEFOOTER = struct.Struct("<QQ")
+# matches, starting on the line break before them, the fields kept from each document (with their continuation lines) and the empty lines that separate documents
+FIELDSREGEX = re.compile(
+    rb"\n(?:PMID[^\n]*|(?:TI|AB)[^\n]*(?:\n  [^\n]*)*|(?=\n))")
+
+
+def readDocuments(filename):
+    """
+    Generator that reads one gzipped input file and fetches the PMID, the TI and the AB of its documents.
+    A pair is yielded for every document separator found, even if the document has no TI nor AB (in that case the content is empty), so that the caller can keep counting documents.
+
+    :param filename: name of the gzipped file to be read
+    :type filename: str
+    :returns: generator of pairs (PMID, content), where the content is the TI concatenated with the AB
+    :rtype: generator<tuple<str, str>>
+
+    """
+    gz = gzip.open(filename, "rb")
+    try:
+        docContent = ""
+        docID = ""
+        add = False
+        for line in io.BufferedReader(gz):
+            line = line.decode("ISO-8859-1")
+            if line.startswith("PMID"):
+                docID = line[6:].strip()
+            elif line.startswith("TI"):
+                docContent += line[6:].strip()+" "
+                add = True
+            elif line.startswith("AB"):
+                docContent += line[6:].strip()+" "
+                add = True
+            elif line.startswith("  "):
+                if add:
+                    docContent += line[6:].strip()+" "
+            elif line == "\n":
+                yield docID, docContent
+                docContent = ""
+                docID = ""
+            else:
+                add = False
+    finally:
+        gz.close()
+
+
+def scanDocuments(filename, blockSize=SCANBLOCKSIZE):
+    """
+    Faster alternative to readDocuments that yields exactly the same pairs.
+    Instead of decoding and testing every line, it reads big blocks of decompressed bytes, cuts them after the last complete document and searches the PMID, TI and AB fields directly on the bytes.
+    Only the fields kept are decoded, and the content of each document is joined only once.
+
+    :param filename: name of the gzipped file to be read
+    :type filename: str
+    :param blockSize: number of decompressed bytes read at once
+    :type blockSize: int
+    :returns: generator of pairs (PMID, content), where the content is the TI concatenated with the AB
+    :rtype: generator<tuple<str, str>>
+
+    """
+    gz = gzip.open(filename, "rb")
+    try:
+        docID = b""
+        docContent = []
+        # every line is matched from the line break that precedes it, hence the initial one
+        rest = b"\n"
+        while True:
+            data = gz.read(blockSize)
+            if not data:
+                break
+            block = rest + data
+            # only complete documents are scanned, the remaining bytes (starting on the last empty line) wait for the next block
+            end = block.rfind(b"\n\n")+2
+            if end < 2:
+                rest = block
+                continue
+            rest = block[end-1:]
+            for field in FIELDSREGEX.findall(block, 0, end):
+                if field == b"\n":
+                    if docContent != []:
+                        yield docID.decode("ISO-8859-1"), b" ".join(docContent).decode("ISO-8859-1")+" "
+                    else:
+                        yield docID.decode("ISO-8859-1"), ""
+                    docID = b""
+                    docContent = []
+                elif field[1] == 80:  # b"P"
+                    docID = field[7:].strip()
+                else:
+                    docContent += [line[6:].strip()
+                                   for line in field[1:].split(b"\n")]
+    finally:
+        gz.close()
+
+
+def parseWorker(filename, queue, batchSize=BATCHSIZE, reader=readDocuments):
+    """
+    Function executed by each process of the ParallelFileParser. Parses one input file and sends its documents to the main process in batches.
+
+    :param filename: name of the gzipped file to be parsed
+    :type filename: str
+    :param queue: bounded queue shared with the main process, the end of the file is signaled with None
+    :type queue: multiprocessing.Queue
+    :param batchSize: number of documents sent in each batch
+    :type batchSize: int
+    :param reader: generator function used to read the documents of the file
+    :type reader: function
+
+    """
+    batch = []
+    for doc in reader(filename):
+        batch.append(doc)
+        if len(batch) >= batchSize:
+            queue.put(batch)
+            batch = []
+    if batch != []:
+        queue.put(batch)
+    queue.put(None)
+
+
+def writeCorpusCache(records, filename):
+    """
+    Function that writes the documents read by a parser to a compact binary file, so that later executions don't need to decompress and parse the input files again.
+    The file contains the magic number, one record per document (PMID length, content length, PMID, content), the table with the position of each record and, at the end, the position of that table and the number of records.
+    Documents without content are also written, in order for the documents count to be the same.
+
+    :param records: generator of pairs (PMID, content), such as the records of a LimitedRamFileParser
+    :type records: generator<tuple<str, str>>
+    :param filename: name of the file to be written
+    :type filename: str
+
+    """
+    offsets = array("Q")
+    f = open(filename, "wb", buffering=SCANBLOCKSIZE)
+    f.write(CACHEMAGIC)
+    offset = len(CACHEMAGIC)
+    for docID, docContent in records:
+        docID = docID.encode("ISO-8859-1")
+        docContent = docContent.encode("ISO-8859-1")
+        offsets.append(offset)
+        f.write(RECORDHEADER.pack(len(docID), len(docContent)))
+        f.write(docID)
+        f.write(docContent)
+        offset += RECORDHEADER.size+len(docID)+len(docContent)
+    f.write(offsets.tobytes())
+    f.write(CACHEFOOTER.pack(offset, len(offsets)))
+    f.close()
+
+
+def readCorpusCache(filename, start=0, stop=None):
+    """
+    Generator that memory-maps a file written by writeCorpusCache and reads its documents, yielding the same pairs the original parser did.
+
+    :param filename: name of the corpus cache file
+    :type filename: str
+    :param start: index of the first document to be read
+    :type start: int
+    :param stop: index after the last document to be read, None to read until the end
+    :type stop: int
+    :returns: generator of pairs (PMID, content)
+    :rtype: generator<tuple<str, str>>
+
+    """
+    f = open(filename, "rb")
+    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mm)
+    try:
+        assert mm[:len(CACHEMAGIC)] == CACHEMAGIC, "Error: " + \
+            filename+" is not a corpus cache file"
+        tableOffset, numRecords = CACHEFOOTER.unpack_from(
+            mm, len(mm)-CACHEFOOTER.size)
+        if stop is None or stop > numRecords:
+            stop = numRecords
+        if start >= stop:
+            return
+        offset = struct.unpack_from("<Q", mm, tableOffset+8*start)[0]
+        for _ in range(start, stop):
+            idLength, contentLength = RECORDHEADER.unpack_from(mm, offset)
+            offset += RECORDHEADER.size
+            docID = str(view[offset:offset+idLength], "ISO-8859-1")
+            offset += idLength
+            docContent = str(view[offset:offset+contentLength], "ISO-8859-1")
+            offset += contentLength
+            yield docID, docContent
+    finally:
+        view.release()
+        mm.close()
+        f.close()
+
+
+def corpusCacheLength(filename):
+    """
+    Function that reads the number of documents in a file written by writeCorpusCache, without reading them.
+
+    :param filename: name of the corpus cache file
+    :type filename: str
+    :returns: number of documents (records) in the file
+    :rtype: int
+
+    """
+    f = open(filename, "rb")
+    f.seek(-CACHEFOOTER.size, os.SEEK_END)
+    numRecords = CACHEFOOTER.unpack(f.read(CACHEFOOTER.size))[1]
+    f.close()
+    return numRecords
+
+
+def countDocuments(records, maxRecords=None):
+    """
+    Function that counts the documents yielded by a generator of records, following the same rules as the parsers: every record counts as a document read, but only the ones with content get an internal docID.
+
+    :param records: generator of pairs (PMID, content), such as the ones returned by readDocuments, scanDocuments or readCorpusCache
+    :type records: generator<tuple<str, str>>
+    :param maxRecords: maximum number of records to be read, None to read them all
+    :type maxRecords: int
+    :returns: number of records read and number of those that have content
+    :rtype: tuple<int, int>
+
+    """
+    numRecords = 0
+    numDocuments = 0
+    for docID, docContent in records:
+        if numRecords == maxRecords:
+            records.close()
+            break
+        numRecords += 1
+        if docContent != "":
+            numDocuments += 1
+    return numRecords, numDocuments
 
 
 class FileParser(ABC):
@@ -19,19 +262,25 @@ class FileParser(ABC):
     :type inputFolder: str
     :param limit: limit number of documents to have in consideration, None if no limit
     :type limit: int
+    :param files: names of the files to be read, None to read every file in the input folder
+    :type files: list<str>
 
     """
 
-    def __init__(self, inputFolder, limit=None):
+    def __init__(self, inputFolder, limit=None, files=None):
         """
         Class constructor
         """
         super().__init__()
         self.content = {}
         self.files = []
-        inputFiles = os.listdir(inputFolder)
-        for f in inputFiles:
-            self.files.append(inputFolder+"/"+f)
+        if files is not None:
+            self.files = list(files)
+        else:
+            # sorted so that the internal docIDs don't depend on the directory listing order
+            inputFiles = sorted(os.listdir(inputFolder))
+            for f in inputFiles:
+                self.files.append(inputFolder+"/"+f)
         self.numDocs = 0
         if limit == None:
             # a number bigger than all the rest
@@ -47,6 +296,17 @@ class FileParser(ABC):
         print("Reading...")
         pass
 
+    @abstractmethod
+    def getBatches(self, batchSize=BATCHSIZE):
+        """
+        Generator alternative to getContent that hands out the documents in batches, instead of one dictionary per document.
+
+        :param batchSize: maximum number of documents in each batch
+        :type batchSize: int
+        """
+        print("Reading...")
+        pass
+
     def clearVar(self):
         """
         Function that frees the memory currently in use by emptying all class variables.
@@ -58,15 +318,34 @@ class FileParser(ABC):
 
 
 class LimitedRamFileParser(FileParser):
+    """
+    Implementation of a parser that reads the input files one after the other, keeping only one document in memory at a time.
 
-    def __init__(self, inputFolder, limit):
+    :param byteScanner: True to read the files with scanDocuments instead of the line by line readDocuments
+    :type byteScanner: bool
+    :param files: names of the files to be read, None to read every file in the input folder
+    :type files: list<str>
+
+    """
+
+    def __init__(self, inputFolder, limit, byteScanner=False, files=None):
         """
         Class constructor
         """
-        super().__init__(inputFolder, limit)
-        if self.files != []:
-            self.gz = gzip.open(self.files.pop(0), "rb")
-            self.f = io.BufferedReader(self.gz)
+        super().__init__(inputFolder, limit, files)
+        self.reader = scanDocuments if byteScanner else readDocuments
+        self.records = self.readFiles()
+
+    def readFiles(self):
+        """
+        Generator that reads the input files one after the other.
+
+        :returns: generator of pairs (PMID, content), one for each document found
+        :rtype: generator<tuple<str, str>>
+
+        """
+        while self.files != []:
+            yield from self.reader(self.files.pop(0))
 
     def getContent(self):
         """
@@ -78,49 +357,133 @@ class LimitedRamFileParser(FileParser):
         :rtype: map<str, str>
 
         """
-        docContent = ""
-        docID = ""
-        add = False
-        for line in self.f:
-            line = line.decode("ISO-8859-1")
-            if line.startswith("PMID"):
-                docID = line[6:].strip()
-            elif line.startswith("TI"):
-                docContent += line[6:].strip()+" "
-                add = True
-            elif line.startswith("AB"):
-                docContent += line[6:].strip()+" "
-                add = True
-            elif line.startswith("  "):
-                if add:
-                    docContent += line[6:].strip()+" "
-            elif line == "\n":
-                self.numDocs += 1
-                if self.numDocs >= self.limit:
-                    self.gz.close()
-                    return None
-                if docContent == "":
-                    continue
-                return {str(docID): docContent}
-            else:
-                add = False
+        for docID, docContent in self.records:
+            self.numDocs += 1
+            if self.numDocs >= self.limit:
+                self.records.close()
+                return None
+            if docContent == "":
                 continue
-        self.gz.close()
+            return {str(docID): docContent}
+        return None
 
-        if self.files != []:
-            self.gz = gzip.open(self.files.pop(0), "rb")
-            self.f = io.BufferedReader(self.gz)
-            return self.getContent()
-        else:
-            return None
+    def getBatches(self, batchSize=BATCHSIZE):
+        """
+        Implementation of the function defined by the abstract class. Fetches the PMID, the TI and the AB, like getContent, but yields lists of documents.
+        Can be used after getContent, continuing from the document where it stopped.
+
+        :param batchSize: maximum number of documents in each batch
+        :type batchSize: int
+        :returns: generator of lists of pairs (PMID, content)
+        :rtype: generator<list<tuple<str, str>>>
+
+        """
+        batch = []
+        for doc in self.records:
+            self.numDocs += 1
+            if self.numDocs >= self.limit:
+                self.records.close()
+                break
+            if doc[1] == "":
+                continue
+            batch.append(doc)
+            if len(batch) >= batchSize:
+                yield batch
+                batch = []
+        if batch != []:
+            yield batch
 
     def clearVar(self):
         """
         Function that frees the memory currently in use by emptying all class variables.
         """
+        if self.records:
+            self.records.close()
         self.content = None
         self.files = None
         self.numDocs = None
         self.limit = None
-        self.gz = None
-        self.f = None
+        self.records = None
+
+
+class CachedFileParser(LimitedRamFileParser):
+    """
+    Implementation of a parser that reads the documents from a corpus cache (written by writeCorpusCache) instead of the gzipped input files.
+
+    :param cacheFile: name of the corpus cache file
+    :type cacheFile: str
+    :param start: index of the first document to be read
+    :type start: int
+    :param stop: index after the last document to be read, None to read until the end
+    :type stop: int
+
+    """
+
+    def __init__(self, inputFolder, limit, cacheFile, start=0, stop=None):
+        """
+        Class constructor
+        """
+        super().__init__(inputFolder, limit)
+        self.records = readCorpusCache(cacheFile, start, stop)
+
+
+class ParallelFileParser(LimitedRamFileParser):
+    """
+    Implementation of a parser that decompresses and parses several input files at the same time, each one in its own process.
+    At most numWorkers files are being parsed at once and each process can only get queueSize batches ahead of the main process, keeping the memory usage bounded.
+    The documents are handed out in the order of the sorted input files, so the internal docIDs are the same as with the LimitedRamFileParser.
+
+    :param numWorkers: maximum number of files parsed at the same time, None to use the number of available cores
+    :type numWorkers: int
+    :param queueSize: maximum number of batches of documents waiting to be consumed in each process
+    :type queueSize: int
+
+    """
+
+    def __init__(self, inputFolder, limit, numWorkers=None, queueSize=QUEUESIZE, byteScanner=False):
+        """
+        Class constructor
+        """
+        super().__init__(inputFolder, limit, byteScanner)
+        self.numWorkers = numWorkers if numWorkers else os.cpu_count()
+        self.queueSize = queueSize
+        self.workers = []
+        for _ in range(self.numWorkers):
+            self.startWorker()
+        self.records = self.readWorkers()
+
+    def startWorker(self):
+        """
+        Auxiliary function that launches the process responsible for the next input file, if there is any left.
+        """
+        if self.files == []:
+            return
+        queue = multiprocessing.Queue(self.queueSize)
+        process = multiprocessing.Process(target=parseWorker, args=(
+            self.files.pop(0), queue, BATCHSIZE, self.reader), daemon=True)
+        process.start()
+        self.workers.append((process, queue))
+
+    def readWorkers(self):
+        """
+        Generator that reads the documents sent by the parsing processes, respecting the order of the input files.
+        When closed before the end (for instance, when the documents limit is reached) it stops every process still running.
+
+        :returns: generator of pairs (PMID, content), one for each document found
+        :rtype: generator<tuple<str, str>>
+
+        """
+        try:
+            while self.workers != []:
+                batch = self.workers[0][1].get()
+                if batch is None:
+                    process, queue = self.workers.pop(0)
+                    process.join()
+                    self.startWorker()
+                    continue
+                yield from batch
+        finally:
+            for process, queue in self.workers:
+                process.terminate()
+                process.join()
+            self.workers = []
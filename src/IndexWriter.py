@@ -0,0 +1,183 @@
+"""
+.. module:: IndexWriter
+    :noindex:
+.. moduleauthor:: Filipe Pires [85122] & Joao Alegria [85048]
+"""
+import zlib
+
+import BinaryIndex
+
+# number of bytes gathered in memory before being written to the file
+WRITEBUFFER = 4*1024*1024
+# name of the file where the positions of a text index are written, when they are kept apart from the postings
+POSITIONSFILE = "_positions"
+# number of bytes of records compressed together in the compressed intermediate indexes, the merge keeps one of these chunks of each intermediate index in memory
+COMPRESSBUFFER = 256*1024
+# zlib compression level of the intermediate indexes, the fastest one since they are only read once
+COMPRESSLEVEL = 1
+
+
+class PartitionWriter:
+    """
+    Class that writes the terms of an index, in order, into partitions named after their first term or into a single file (used for the intermediate indexes).
+    The lines (or binary records) are gathered in a list and joined into a single write whenever WRITEBUFFER bytes are reached, and the lexicon entries are given the exact position of each term in its partition.
+    The limit is checked before each line is written: a line that doesn't fit in the current partition starts a new one, so a partition only goes over the limit when its single line does.
+    For the terms with more postings than the champions tier of the lexicon, the length of the tier (the line or record up to the end of its last posting) is found and given to the lexicon too.
+
+    :param outputFolder: name of the folder where the partitions are written
+    :type outputFolder: str
+    :param fileLimit: maximum number of bytes of each partition
+    :type fileLimit: int
+    :param overrideFile: name of the single file to be written, None to write partitions into the output folder
+    :type overrideFile: str
+    :param lexicon: lexicon where the terms are added, None if the index has no lexicon
+    :type lexicon: Lexicon.LexiconWriter
+    :param header: header written at the beginning of each file of a binary index, None for a text index
+    :type header: bytes
+    :param manifest: manifest where the partitions are described, None if the index has no manifest
+    :type manifest: Manifest.ManifestWriter
+    :param compress: True if the records are to be compressed with zlib, in chunks of COMPRESSBUFFER bytes each preceded by its length (used for the binary intermediate indexes, see BinaryIndex.COMPRESSEDFLAG)
+    :type compress: bool
+    :param separator: separator of the postings in each line of a text index, to find the champions tier
+    :type separator: str
+    """
+
+    def __init__(self, outputFolder, fileLimit=float("inf"), overrideFile=None, lexicon=None, header=None, manifest=None, compress=False, separator=";"):
+        """
+        Class constructor
+        """
+        self.outputFolder = outputFolder
+        self.fileLimit = fileLimit
+        self.overrideFile = overrideFile
+        self.lexicon = lexicon
+        self.header = header
+        self.manifest = manifest
+        self.compress = compress
+        self.separator = separator
+        self.bufferSize = COMPRESSBUFFER if compress else WRITEBUFFER
+        self.file = None
+        self.numTerms = 0
+        self.pending = []
+        self.pendingSize = 0
+        self.position = 0
+
+    def write(self, term, record, df, start=0, end=None, positions=None):
+        """
+        Function that writes the line (or binary record) of a term.
+
+        :param term: the term
+        :type term: str
+        :param record: line of a text index, with its line break, or record of a binary index
+        :type record: str or bytes
+        :param df: number of postings of the term
+        :type df: int
+        :param start: position of the postings in the record, for the lexicon
+        :type start: int
+        :param end: position after the postings in the record, None if they go until its end
+        :type end: int
+        :param positions: position and length of the positions of the term in the positions file, for the lexicon, None if they are in the record
+        :type positions: tuple<int, int>
+        :returns: position of the record in its file and its length, in bytes
+        :rtype: tuple<int, int>
+        """
+        if self.header is not None or record.isascii():
+            size = len(record)
+        else:
+            size = len(record.encode("utf-8"))
+        if self.file is not None and self.overrideFile is None and self.numTerms > 0 and self.position+size > self.fileLimit:
+            self.closePartition()
+        if self.file is None:
+            self.openPartition(term)
+        if self.lexicon:
+            champions = None
+            if df > self.lexicon.champions:
+                champions = self.championsEnd(record, start, end)
+                if champions is not None:
+                    champions -= start
+            self.lexicon.add(term, self.file.name, self.position+start,
+                             (size if end is None else end)-start, df, positions, champions)
+        self.pending.append(record)
+        self.pendingSize += size
+        self.position += size
+        self.numTerms += 1
+        if self.manifest:
+            self.manifest.add(term, self.file.name, self.position)
+        if self.pendingSize >= self.bufferSize:
+            self.flush()
+        return self.position-size, size
+
+    def championsEnd(self, record, start, end):
+        """
+        Auxiliary function that finds the end of the champions tier of a term in its line (or binary record).
+
+        :param record: line of a text index or record of a binary index
+        :type record: str or bytes
+        :param start: position of the postings in the record
+        :type start: int
+        :param end: position after the postings in the record, None if they go until its end
+        :type end: int
+        :returns: position after the last posting of the tier in the record, in bytes, None if the tier has all the postings
+        :rtype: int
+        """
+        if self.header is not None:
+            return BinaryIndex.championsEnd(record, start, len(record) if end is None else end, self.lexicon.champions)
+        # the tier ends right before the separator that follows its last posting, the first separator being the one after the term
+        pos = -1
+        for i in range(self.lexicon.champions+1):
+            pos = record.find(self.separator, pos+1)
+            if pos < 0:
+                return None
+        return pos if record.isascii() else len(record[:pos].encode("utf-8"))
+
+    def openPartition(self, term):
+        """
+        Auxiliary function that starts a new file, named after its first term.
+
+        :param term: first term of the file
+        :type term: str
+        """
+        self.file = open(self.overrideFile if self.overrideFile else self.outputFolder+"/"+term, "wb")
+        self.position = 0
+        self.numTerms = 0
+        if self.compress:
+            # the header isn't compressed, so the format of the file can still be recognized
+            self.file.write(self.header)
+            self.position = len(self.header)
+        elif self.header is not None:
+            self.pending.append(self.header)
+            self.pendingSize += len(self.header)
+            self.position = len(self.header)
+
+    def flush(self):
+        """
+        Auxiliary function that writes what was gathered in memory to the current file.
+        """
+        if self.pending == []:
+            return
+        if self.header is None:
+            self.file.write("".join(self.pending).encode("utf-8"))
+        elif self.compress:
+            chunk = zlib.compress(b"".join(self.pending), COMPRESSLEVEL)
+            length = bytearray()
+            BinaryIndex.writeVarint(length, len(chunk))
+            self.file.write(length)
+            self.file.write(chunk)
+        else:
+            self.file.write(b"".join(self.pending))
+        self.pending = []
+        self.pendingSize = 0
+
+    def closePartition(self):
+        """
+        Auxiliary function that writes what was gathered in memory and closes the current file.
+        """
+        self.flush()
+        self.file.close()
+        self.file = None
+
+    def close(self):
+        """
+        Function that finishes the writing, closing the current file. The lexicon and the manifest aren't closed, since more terms can still be added to them.
+        """
+        if self.file is not None:
+            self.closePartition()
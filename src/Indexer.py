@@ -4,13 +4,142 @@
 .. moduleauthor:: Filipe Pires [85122] & Joao Alegria [85048]
 """
 import re
+import sys
 import math
+import heapq
 from decimal import *
 import time
+from itertools import accumulate
+from array import array
 from abc import ABC, abstractmethod
 
 LIMITCACHE = 3
 getcontext().prec = 2
+# approximate number of bytes taken by one dictionary entry (hash, key and value pointers and the spare room of the table)
+DICTENTRYBYTES = 100
+# approximate number of bytes taken by the metadata of each document (its translation and, with weights, its best terms)
+DOCUMENTBYTES = 170
+BESTTERMSBYTES = DICTENTRYBYTES+90
+BESTTERMBYTES = 80
+# arrays grow in steps, so on average they hold some unused room
+ARRAYGROWTH = 1.125
+# approximate number of postings whose weights are calculated at once, in the deferred weights mode
+WEIGHTSCHUNK = 1024*1024
+# square of 1+log10(tf) for the most common term frequencies, calculated as while indexing with weights
+TFSQUARES = [0.0]+[(1+math.log10(tf))**2 for tf in range(1, 256)]
+# distance to half-way under which a scaled weight is rounded by Python's round instead of NumPy, see roundWeights
+HALFWAY = 1e-6
+
+
+def roundWeights(weights):
+    """
+    Function that rounds weights to 2 decimal places with NumPy, giving the same values as Python's round.
+    NumPy rounds the weights scaled by 100, which isn't exact close to half-way (for instance, numpy.round takes 0.025 to 0.02 and round to 0.03), so those few weights are rounded by round instead.
+
+    :param weights: weights to be rounded
+    :type weights: numpy.ndarray
+    :returns: rounded weights
+    :rtype: numpy.ndarray
+
+    """
+    import numpy
+    scaled = weights*100
+    rounded = numpy.rint(scaled)/100
+    halfway = numpy.flatnonzero(
+        numpy.abs(scaled-numpy.floor(scaled)-0.5) < HALFWAY)
+    rounded[halfway] = [round(w, 2) for w in weights[halfway].tolist()]
+    return rounded
+
+
+def bestPostings(docs, weights, ranks, termIDs, k):
+    """
+    Function that selects, with NumPy, the k postings with the highest weights of each document (for equal weights, the ones of the terms that appear first in the document, as heapq.nlargest does when the weights are calculated while indexing).
+
+    :param docs: document of each posting
+    :type docs: numpy.ndarray
+    :param weights: weight of each posting
+    :type weights: numpy.ndarray
+    :param ranks: order in which the term of each posting first appears in its document
+    :type ranks: numpy.ndarray
+    :param termIDs: termID of each posting
+    :type termIDs: numpy.ndarray
+    :param k: maximum number of postings selected per document
+    :type k: int
+    :returns: documents, weights, ranks and termIDs of the selected postings, ordered by document and by decreasing weight
+    :rtype: tuple<numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray>
+
+    """
+    import numpy
+    order = numpy.lexsort((ranks, -weights, docs))
+    docs = docs[order]
+    # place of each posting in its document: its position minus the position of the first posting of the document
+    starts = numpy.flatnonzero(numpy.r_[True, docs[1:] != docs[:-1]])
+    places = numpy.arange(len(docs)) - numpy.repeat(starts,
+                                                   numpy.diff(numpy.r_[starts, len(docs)]))
+    selected = places < k
+    order = order[selected]
+    return docs[selected], weights[order], ranks[order], termIDs[order]
+
+
+class Postings:
+    """
+    Compact posting list of one term of the in-memory index, stored column by column in typed arrays instead of one dictionary entry and list per document.
+    The positions of all the documents are packed in a single array, the term frequency of each document tells how many of them belong to it.
+
+    :param weights: flag that indicates if the weights are stored
+    :type weights: boolean
+    :param positions: flag that indicates if the positions are stored
+    :type positions: boolean
+    :param ranks: flag that indicates if the order in which the term first appears in each document is stored (used to select the best terms of the documents in the deferred weights mode)
+    :type ranks: boolean
+
+    """
+    __slots__ = ("docs", "tfs", "weights", "positions", "ranks")
+
+    def __init__(self, weights, positions, ranks=False):
+        """
+        Class constructor
+        """
+        self.docs = array("I")
+        self.tfs = array("I")
+        self.weights = array("d") if weights else None
+        self.positions = array("I") if positions else None
+        self.ranks = array("I") if ranks else None
+
+    def __len__(self):
+        return len(self.docs)
+
+    def values(self):
+        """
+        Function that returns the column with the value written for each posting: the weight if it was calculated, the term frequency if not.
+
+        :returns: weights or term frequencies, by document
+        :rtype: array
+        """
+        return self.weights if self.weights is not None else self.tfs
+
+    def offsets(self):
+        """
+        Function that calculates where the positions of each document start in the packed positions array.
+
+        :returns: list with one offset per document, plus the total number of positions
+        :rtype: list<int>
+        """
+        return list(accumulate(self.tfs, initial=0))
+
+    def sortedIndexes(self):
+        """
+        Function that orders the postings by decreasing value (and positions, for equal values), the order in which they are persisted.
+
+        :returns: indexes of the postings, sorted
+        :rtype: list<int>
+        """
+        values = self.values()
+        if self.positions is None:
+            return sorted(range(len(self.docs)), key=values.__getitem__, reverse=True)
+        offsets = self.offsets()
+        positions = self.positions
+        return sorted(range(len(self.docs)), key=lambda i: (values[i], positions[offsets[i]:offsets[i+1]]), reverse=True)
 
 
 class Indexer(ABC):
@@ -25,10 +154,14 @@ class Indexer(ABC):
     :type weights: boolean
     :param fileParser: instance of the file parser used in the context to retrieve the data from the corpus
     :type fileParser: FileParser
+    :param cacheSize: number of best terms kept for each document in the documents cache (used by the Rocchio feedback), when the weights are calculated
+    :type cacheSize: int
+    :param deferWeights: flag that indicates if the weights are only calculated when the block is persisted, in bulk, instead of while each document is indexed
+    :type deferWeights: boolean
 
     """
 
-    def __init__(self, tokenizer, positions, weights, fileParser=None):
+    def __init__(self, tokenizer, positions, weights, fileParser=None, cacheSize=LIMITCACHE, deferWeights=False):
         """
         Class constructor
         """
@@ -42,10 +175,32 @@ class Indexer(ABC):
         # when postions=True, index is only positions cuz the frequency is the position array length
         self.positions = positions
         self.weights = weights
-        self.index = {}
+        # the index is a list of Postings indexed by termID, the term dictionary translates between terms and termIDs
+        self.index = []
+        self.termIDs = {}
+        self.terms = []
         self.docID = 0
         self.translation = []
         self.bestTerms = {}
+        self.cacheSize = cacheSize
+        # in the deferred mode only the term frequencies and the length of each document of the block are stored, the weights are calculated by computeWeights
+        self.deferWeights = weights and deferWeights
+        self.pendingWeights = False
+        self.lengths = array("d")
+        # in the deferred mode, the best terms of each document are selected by computeWeights, which breaks ties by the order in which the terms first appear in the document
+        self.keepRanks = self.deferWeights and cacheSize > 0
+        # estimated number of bytes held by the current block, see estimateMemory
+        self.memoryPostings = 0
+        self.memoryPositions = 0
+        self.memoryVocabulary = 0
+        self.memoryDocuments = 0
+        empty = Postings(weights, positions, self.keepRanks)
+        self.termBytes = sys.getsizeof(empty) + sum(sys.getsizeof(column) for column in (
+            empty.docs, empty.tfs, empty.weights, empty.positions, empty.ranks) if column is not None) + DICTENTRYBYTES + 8
+        self.postingBytes = empty.docs.itemsize + empty.tfs.itemsize + \
+            (empty.weights.itemsize if weights else 0) + \
+            (empty.ranks.itemsize if self.keepRanks else 0)
+        self.positionBytes = empty.positions.itemsize if positions else 0
 
     @abstractmethod
     def createIndex(self, content=None):
@@ -57,14 +212,133 @@ class Indexer(ABC):
             self.docs = content
         # print("Indexing...")
 
+    @abstractmethod
+    def indexBatch(self, batch, tokensList=None):
+        """
+        Function that adds a batch of documents to the index, as an alternative to calling createIndex for each one of them.
+
+        :param batch: list of documents to be indexed
+        :type batch: list<tuple<str, str>>
+        :param tokensList: tokens of each document of the batch, when they were already produced by the tokenizer (for instance, in other processes), None to tokenize the documents here
+        :type tokensList: list<list<str>>
+        """
+        pass
+
+    def items(self):
+        """
+        Function that materializes the terms of the index, to be used when it is persisted.
+
+        :returns: list of pairs (term, postings), in no particular order
+        :rtype: list<tuple<str, Postings>>
+
+        """
+        self.computeWeights()
+        terms = self.terms
+        return [(terms[termID], postings) for termID, postings in enumerate(self.index)]
+
+    def computeWeights(self):
+        """
+        Function that calculates, in bulk, the weights left for later by the deferred weights mode: 1+log10(tf) of each posting, normalized by the length of its document and rounded to 2 decimal places.
+        The postings are processed with NumPy, in chunks of terms, dividing by the lengths of the documents summed while indexing, and give the same weights as when they are calculated while indexing.
+        """
+        if not self.pendingWeights:
+            return
+        # NumPy is only loaded by the deferred weights mode, since it takes about 15Mb of memory
+        import numpy
+        self.pendingWeights = False
+        firstDocID = self.translation[0][0]
+        lengths = numpy.array(self.lengths)
+        chunks = [[]]
+        numPostings = 0
+        for postings in self.index:
+            if numPostings >= WEIGHTSCHUNK:
+                chunks.append([])
+                numPostings = 0
+            chunks[-1].append(postings)
+            numPostings += len(postings.docs)
+
+        # documents, weights, ranks and termIDs of the best postings of each document, by chunk
+        candidates = []
+        firstTermID = 0
+        for chunk in chunks:
+            docs, weights = self.chunkColumns(chunk, firstDocID)
+            weights = roundWeights(weights/lengths[docs])
+            if self.cacheSize > 0:
+                sizes = numpy.fromiter((len(postings.docs) for postings in chunk),
+                                       dtype=numpy.intp, count=len(chunk))
+                termIDs = numpy.repeat(numpy.arange(
+                    firstTermID, firstTermID+len(chunk)), sizes)
+                ranks = numpy.frombuffer(
+                    b"".join(postings.ranks for postings in chunk), dtype="I")
+                candidates.append(bestPostings(
+                    docs, weights, ranks, termIDs, self.cacheSize))
+            firstTermID += len(chunk)
+            # the weights of the chunk are split back by term, each one taking 8 bytes
+            weights = weights.tobytes()
+            start = 0
+            for postings in chunk:
+                end = start+8*len(postings.docs)
+                postings.weights = array("d", weights[start:end])
+                postings.ranks = None
+                start = end
+
+        if self.cacheSize > 0:
+            docs, weights, ranks, termIDs = bestPostings(
+                *(numpy.concatenate(column) for column in zip(*candidates)), self.cacheSize)
+            terms = self.terms
+            self.bestTerms = {docID: [] for docID, docPMID in self.translation}
+            for doc, weight, termID in zip(docs.tolist(), weights.tolist(), termIDs.tolist()):
+                self.bestTerms[doc+firstDocID].append((terms[termID], weight))
+
+    def chunkColumns(self, chunk, firstDocID):
+        """
+        Auxiliary function of computeWeights that joins the columns of a chunk of postings into NumPy arrays.
+
+        :param chunk: posting lists to be joined
+        :type chunk: list<Postings>
+        :param firstDocID: docID of the first document of the block
+        :type firstDocID: int
+        :returns: the documents of the postings, relative to the first document of the block, and 1+log10(tf) of each one of them
+        :rtype: tuple<numpy.ndarray, numpy.ndarray>
+
+        """
+        import numpy
+        docs = numpy.frombuffer(
+            b"".join(postings.docs for postings in chunk), dtype="I") - firstDocID
+        tfs = numpy.frombuffer(
+            b"".join(postings.tfs for postings in chunk), dtype="I")
+        # 1+log10(tf) is calculated once per term frequency by math.log10, as while indexing, since numpy.log10 may differ in the last bit
+        table = numpy.array(
+            [0.0]+[1+math.log10(tf) for tf in range(1, int(tfs.max(initial=0))+1)])
+        return docs, table[tfs]
+
+    def estimateMemory(self):
+        """
+        Function that estimates the memory held by the current block of the index, much cheaper than asking the operating system and not affected by memory the process doesn't give back.
+        The postings, the positions, the vocabulary (terms, term dictionary and per term structures) and the documents metadata are accounted separately.
+
+        :returns: estimated number of bytes
+        :rtype: int
+
+        """
+        return self.memoryPostings + self.memoryPositions + self.memoryVocabulary + self.memoryDocuments
+
     def clearVar(self):
         """
         Function that frees the memory currently in use by emptying all class variables.
         """
-        self.index = {}
+        self.index = []
+        self.termIDs = {}
+        self.terms = []
         self.docs = {}
         self.translation = []
         self.bestTerms = {}
+        self.memoryPostings = 0
+        self.memoryPositions = 0
+        self.memoryVocabulary = 0
+        self.memoryDocuments = 0
+        self.pendingWeights = False
+        self.lengths = array("d")
 
 
 class FileIndexer(Indexer):
@@ -77,63 +351,102 @@ class FileIndexer(Indexer):
         Implementation of the function defined by the abstract class.
         """
         super().createIndex(content)
-        docPMID = list(content.keys())[0]
-        self.docID += 1
-        self.translation.append([str(self.docID), docPMID])
-        docContent = list(content.values())[0]
-        self.tokenizer.tokenize(docContent)
-        tmpTC = {}
-        for idx, t in enumerate(self.tokenizer.tokens):
-            if t not in tmpTC:
-                if self.positions:
-                    tmpTC[t] = {str(self.docID): [1, [idx+1]]}
+        self.indexBatch(content.items())
+
+    def indexBatch(self, batch, tokensList=None):
+        """
+        Implementation of the function defined by the abstract class.
+        """
+        batch = list(batch)
+        if tokensList is None:
+            tokensList = self.tokenizer.tokenizeMany(
+                docContent for docPMID, docContent in batch)
+        termIDs = self.termIDs
+        index = self.index
+        numPostings = 0
+        numPositions = 0
+        vocabulary = 0
+        documents = 0
+        squares = TFSQUARES
+        numSquares = len(TFSQUARES)
+        for (docPMID, docContent), tokens in zip(batch, tokensList):
+            self.docID += 1
+            docID = self.docID
+            self.translation.append([docID, docPMID])
+            documents += DOCUMENTBYTES+sys.getsizeof(docPMID)
+            # term -> [count, positions, weight] of the current document
+            tmpTC = {}
+            for idx, t in enumerate(tokens):
+                posts = tmpTC.get(t)
+                if posts is None:
+                    if self.positions:
+                        tmpTC[t] = [1, [idx+1], None]
+                    else:
+                        tmpTC[t] = [1, None, None]
                 else:
-                    tmpTC[t] = {str(self.docID): [1, None]}
-            elif str(self.docID) not in tmpTC[t]:
-                if self.positions:
-                    tmpTC[t][str(self.docID)] = [1, [idx+1]]
+                    posts[0] += 1
+                    if self.positions:
+                        posts[1].append(idx+1)
+            numPostings += len(tmpTC)
+            if self.positions:
+                numPositions += len(tokens)
+            if self.deferWeights:
+                # the length of the document is summed in the same order as when the weights are calculated while indexing, so the weights are rounded from the same values
+                norme = 0
+                for posts in tmpTC.values():
+                    tf = posts[0]
+                    norme += squares[tf] if tf < numSquares else (
+                        1+math.log10(tf))**2
+                self.lengths.append(math.sqrt(norme))
+                documents += self.lengths.itemsize
+                # the best terms are also selected by computeWeights, but their memory is accounted now
+                self.pendingWeights = True
+                if self.cacheSize > 0:
+                    documents += BESTTERMSBYTES + \
+                        min(self.cacheSize, len(tmpTC))*BESTTERMBYTES
+            elif self.weights:
+                norme = 0
+                for posts in tmpTC.values():
+                    posts[2] = 1+math.log10(posts[0])
+                    norme += posts[2]**2
+                norme = math.sqrt(norme)
+                for posts in tmpTC.values():
+                    posts[2] = round(posts[2]/norme, 2)
+                if self.cacheSize > 0:
+                    # top K terms of the document by weight, selected with a bounded heap
+                    self.bestTerms[docID] = [(term, posts[2]) for term, posts in heapq.nlargest(
+                        self.cacheSize, tmpTC.items(), key=lambda item: item[1][2])]
+                    documents += BESTTERMSBYTES + \
+                        len(self.bestTerms[docID])*BESTTERMBYTES
+
+            for rank, (term, posts) in enumerate(tmpTC.items()):
+                termID = termIDs.get(term)
+                if termID is None:
+                    termIDs[term] = len(index)
+                    self.terms.append(term)
+                    postings = Postings(
+                        self.weights and not self.deferWeights, self.positions, self.keepRanks)
+                    index.append(postings)
+                    vocabulary += self.termBytes+sys.getsizeof(term)
                 else:
-                    tmpTC[t][str(self.docID)] = [1, None]
-            else:
-                tmpTC[t][str(self.docID)][0] = tmpTC[t][str(self.docID)][0]+1
+                    postings = index[termID]
+                postings.docs.append(docID)
+                postings.tfs.append(posts[0])
+                if self.weights and not self.deferWeights:
+                    postings.weights.append(posts[2])
                 if self.positions:
-                    tmpTC[t][str(self.docID)][1].append(idx+1)
-        if self.weights:
-            norme = 0
-            for term, docs in tmpTC.items():
-                for doc, posts in docs.items():
-                    posts[0] = 1+math.log10(posts[0])
-                    norme += posts[0]**2
-            norme = math.sqrt(norme)
-            for term, docs in tmpTC.items():
-                for doc, posts in docs.items():
-                    posts[0] = round(posts[0]/norme, 2)
-
-                    if doc not in self.bestTerms:
-                        self.bestTerms[doc] = [(term, posts[0])]
-                    else:
-                        if len(self.bestTerms[doc]) < LIMITCACHE:
-                            self.bestTerms[doc].append((term, posts[0]))
-                        else:
-                            for t, w in self.bestTerms[doc]:
-                                if posts[0] > w:
-                                    self.bestTerms[doc].remove((t, w))
-                                    self.bestTerms[doc].append(
-                                        (term, posts[0]))
-
-        for x in tmpTC:
-            if x not in self.index:
-                self.index[x] = tmpTC[x]
-            else:
-                self.index[x].update(**tmpTC[x])
-        tmpTC = {}
-        self.tokenizer.tokens = []
+                    postings.positions.extend(posts[1])
+                if self.keepRanks:
+                    postings.ranks.append(rank)
+
+        self.memoryPostings += int(numPostings*self.postingBytes*ARRAYGROWTH)
+        self.memoryPositions += int(numPositions *
+                                    self.positionBytes*ARRAYGROWTH)
+        self.memoryVocabulary += vocabulary
+        self.memoryDocuments += documents
 
     def clearVar(self):
         """
         Function that frees the memory currently in use by emptying all class variables.
         """
-        self.index = {}
-        self.docs = {}
-        self.translation = []
-        self.bestTerms = {}
+        super().clearVar()
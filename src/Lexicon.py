@@ -0,0 +1,306 @@
+"""
+.. module:: Lexicon
+    :noindex:
+.. moduleauthor:: Filipe Pires [85122] & Joao Alegria [85048]
+"""
+import os
+import math
+import mmap
+import struct
+from array import array
+
+import BinaryIndex
+
+# name of the lexicon file, written in the index folder next to the partitions (terms never start with "_", so it can't be mistaken for one)
+LEXICONFILE = "_lexicon"
+# identifies the lexicon files, its last character being the version of the format
+LEXICONMAGIC = b"RILEXICON1"
+# number of terms of each block, the first one written in full and the others front coded
+LEXICONBLOCK = 16
+# trailer at the end of the file: position of the block index, number of blocks and position of the partition names
+LEXICONTRAILER = struct.Struct("=QQQ")
+# number of postings of the champions tier of each term, the first ones of its postings (the ones with the highest weights), whose length is kept apart so they can be read alone
+CHAMPIONSTIER = 1000
+
+
+class LexiconWriter:
+    """
+    Class that writes the lexicon of an index: for each term, in order, the partition where its postings are, their position (in bytes) and length, the length of its champions tier, the number of postings, the idf and, when the positions are kept in their own file, their position and length in that file.
+    The terms are written in blocks of LEXICONBLOCK, each one starting with its first term in full and followed by the others front coded (the length of the prefix shared with the previous term and the rest of the term).
+    Each term is followed by its entry, with the position of the postings (and of the positions) given relative to the end of the previous ones in the same partition. The length of the champions tier is written as the length of the postings that follow it, 0 for the terms with no more than CHAMPIONSTIER postings. The magic number is followed by one byte telling if the entries have the positions and by the size of the champions tier. The file ends with the names of the partitions, the position of each block (the block index) and the trailer, so it can be searched without being loaded (see LexiconReader).
+
+    :param outputFolder: name of the folder where the index is written
+    :type outputFolder: str
+    :param totalNumDocs: total number of documents, used to calculate the idf of the terms
+    :type totalNumDocs: int
+    :param positions: True if the positions of the index are kept in their own file
+    :type positions: bool
+    :param champions: number of postings of the champions tier of each term
+    :type champions: int
+    """
+
+    def __init__(self, outputFolder, totalNumDocs, positions=False, champions=CHAMPIONSTIER):
+        """
+        Class constructor
+        """
+        self.file = open(outputFolder+"/"+LEXICONFILE, "wb")
+        header = bytearray(LEXICONMAGIC+bytes([positions]))
+        BinaryIndex.writeVarint(header, champions)
+        self.file.write(header)
+        self.position = len(header)
+        self.totalNumDocs = totalNumDocs
+        self.positions = positions
+        self.champions = champions
+        self.partitions = {}
+        self.blocks = array("Q")
+        self.block = bytearray()
+        self.blockTerms = 0
+        self.previousTerm = b""
+        self.previousPartition = None
+        self.previousEnd = 0
+        self.previousPositionsEnd = 0
+
+    def add(self, term, filename, offset, length, df, positions=None, champions=None):
+        """
+        Function that adds a term to the lexicon, the terms being added in order.
+
+        :param term: the term
+        :type term: str
+        :param filename: name of the partition where the postings of the term are
+        :type filename: str
+        :param offset: position of the postings in the partition, in bytes
+        :type offset: int
+        :param length: length of the postings, in bytes
+        :type length: int
+        :param df: number of postings of the term
+        :type df: int
+        :param positions: position and length of the positions of the term in the positions file, when the lexicon has them
+        :type positions: tuple<int, int>
+        :param champions: length of the champions tier, in bytes from the position of the postings, None if the term has no more postings than the tier
+        :type champions: int
+        """
+        if self.blockTerms == LEXICONBLOCK:
+            self.flushBlock()
+        term = term.encode("utf-8")
+        partition = self.partitions.setdefault(
+            os.path.basename(filename), len(self.partitions))
+        if self.blockTerms == 0:
+            BinaryIndex.writeVarint(self.block, len(term))
+            self.block += term
+            # the first position of each block is absolute, so the block can be read on its own
+            self.previousPartition = None
+        else:
+            prefix = 0
+            limit = min(len(term), len(self.previousTerm))
+            while prefix < limit and term[prefix] == self.previousTerm[prefix]:
+                prefix += 1
+            BinaryIndex.writeVarint(self.block, prefix)
+            BinaryIndex.writeVarint(self.block, len(term)-prefix)
+            self.block += term[prefix:]
+        BinaryIndex.writeVarint(self.block, partition)
+        BinaryIndex.writeVarint(
+            self.block, offset-self.previousEnd if partition == self.previousPartition else offset)
+        BinaryIndex.writeVarint(self.block, length)
+        BinaryIndex.writeVarint(
+            self.block, length-champions if champions is not None else 0)
+        BinaryIndex.writeVarint(self.block, df)
+        BinaryIndex.writeVarint(self.block, round(
+            round(math.log10(self.totalNumDocs/df), 2)*BinaryIndex.QUANTUM))
+        if self.positions:
+            # the positions file is written in the order of the terms, so only the first position of each block isn't 0
+            BinaryIndex.writeVarint(
+                self.block, positions[0]-self.previousPositionsEnd if self.blockTerms > 0 else positions[0])
+            BinaryIndex.writeVarint(self.block, positions[1])
+            self.previousPositionsEnd = positions[0]+positions[1]
+        self.blockTerms += 1
+        self.previousTerm = term
+        self.previousPartition = partition
+        self.previousEnd = offset+length
+
+    def flushBlock(self):
+        """
+        Auxiliary function that writes the current block to the file.
+        """
+        if self.blockTerms == 0:
+            return
+        self.blocks.append(self.position)
+        self.file.write(self.block)
+        self.position += len(self.block)
+        self.block = bytearray()
+        self.blockTerms = 0
+
+    def close(self):
+        """
+        Function that writes the last block, the names of the partitions, the block index and the trailer, and closes the lexicon file.
+        """
+        self.flushBlock()
+        names = bytearray()
+        for name in self.partitions:
+            name = name.encode("utf-8")
+            BinaryIndex.writeVarint(names, len(name))
+            names += name
+        partitionsPosition = self.position
+        self.file.write(names)
+        blocksPosition = partitionsPosition+len(names)
+        self.file.write(self.blocks.tobytes())
+        self.file.write(LEXICONTRAILER.pack(
+            blocksPosition, len(self.blocks), partitionsPosition))
+        self.file.close()
+
+
+class LexiconReader:
+    """
+    Class that searches the lexicon written by LexiconWriter. The file is mapped in memory and only the names of the partitions are loaded: each search is a binary search over the first terms of the blocks, through the block index, followed by the decoding of a single block.
+
+    :param filename: name of the lexicon file
+    :type filename: str
+    """
+
+    def __init__(self, filename):
+        """
+        Class constructor
+        """
+        self.file = open(filename, "rb")
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        assert self.buf[:len(LEXICONMAGIC)-1] == LEXICONMAGIC[:-1], "Error: " + \
+            filename+" isn't a lexicon"
+        assert self.buf[:len(LEXICONMAGIC)] == LEXICONMAGIC, "Error: unsupported lexicon version in " + \
+            filename+", rebuild the index"
+        self.blocksPosition, self.numBlocks, partitionsPosition = LEXICONTRAILER.unpack_from(
+            self.buf, len(self.buf)-LEXICONTRAILER.size)
+        self.positions = bool(self.buf[len(LEXICONMAGIC)])
+        self.champions, _ = BinaryIndex.readVarint(self.buf, len(LEXICONMAGIC)+1)
+        self.partitions = []
+        pos = partitionsPosition
+        while pos < self.blocksPosition:
+            length, pos = BinaryIndex.readVarint(self.buf, pos)
+            self.partitions.append(str(self.buf[pos:pos+length], "utf-8"))
+            pos += length
+        self.blocksEnd = partitionsPosition
+
+    def blockPosition(self, block):
+        """
+        Auxiliary function that gives the position of a block, from the block index.
+
+        :param block: number of the block
+        :type block: int
+        :returns: position of the block in the file
+        :rtype: int
+        """
+        return struct.unpack_from("=Q", self.buf, self.blocksPosition+8*block)[0]
+
+    def firstTerm(self, block):
+        """
+        Auxiliary function that reads the first term of a block.
+
+        :param block: number of the block
+        :type block: int
+        :returns: the term, encoded in UTF-8
+        :rtype: bytes
+        """
+        length, pos = BinaryIndex.readVarint(self.buf, self.blockPosition(block))
+        return self.buf[pos:pos+length]
+
+    def readBlock(self, block):
+        """
+        Generator that decodes the terms of a block and their entries.
+
+        :param block: number of the block
+        :type block: int
+        :returns: generator of pairs (term encoded in UTF-8, entry), the entry being the partition, the position and length of the postings, the number of postings, the idf, the position and length of the positions in the positions file (None if the index doesn't have one) and the length of the champions tier
+        :rtype: generator<tuple<bytes, tuple<str, int, int, int, float, int, int, int>>>
+        """
+        buf = self.buf
+        pos = self.blockPosition(block)
+        end = self.blockPosition(
+            block+1) if block+1 < self.numBlocks else self.blocksEnd
+        term = None
+        previousPartition = None
+        previousEnd = 0
+        positionsOffset = positionsLength = None
+        previousPositionsEnd = 0
+        while pos < end:
+            if term is None:
+                length, pos = BinaryIndex.readVarint(buf, pos)
+                term = buf[pos:pos+length]
+                pos += length
+            else:
+                prefix, pos = BinaryIndex.readVarint(buf, pos)
+                length, pos = BinaryIndex.readVarint(buf, pos)
+                term = term[:prefix]+buf[pos:pos+length]
+                pos += length
+            partition, pos = BinaryIndex.readVarint(buf, pos)
+            offset, pos = BinaryIndex.readVarint(buf, pos)
+            length, pos = BinaryIndex.readVarint(buf, pos)
+            rest, pos = BinaryIndex.readVarint(buf, pos)
+            df, pos = BinaryIndex.readVarint(buf, pos)
+            idf, pos = BinaryIndex.readVarint(buf, pos)
+            if self.positions:
+                positionsOffset, pos = BinaryIndex.readVarint(buf, pos)
+                positionsLength, pos = BinaryIndex.readVarint(buf, pos)
+                positionsOffset += previousPositionsEnd
+                previousPositionsEnd = positionsOffset+positionsLength
+            if partition == previousPartition:
+                offset += previousEnd
+            previousPartition = partition
+            previousEnd = offset+length
+            yield term, (self.partitions[partition], offset, length, df, idf/BinaryIndex.QUANTUM, positionsOffset, positionsLength, length-rest)
+
+    def find(self, term):
+        """
+        Function that searches a term in the lexicon.
+
+        :param term: the term
+        :type term: str
+        :returns: the partition where the postings of the term are, their position and length, the number of postings, the idf, the position and length of the positions and the length of the champions tier (see readBlock), None if the term isn't in the index
+        :rtype: tuple<str, int, int, int, float, int, int, int>
+        """
+        term = term.encode("utf-8")
+        # the last block whose first term doesn't come after the term
+        low, high = 0, self.numBlocks
+        while low < high:
+            middle = (low+high)//2
+            if self.firstTerm(middle) <= term:
+                low = middle+1
+            else:
+                high = middle
+        if low == 0:
+            return None
+        for blockTerm, entry in self.readBlock(low-1):
+            if blockTerm == term:
+                return entry
+            if blockTerm > term:
+                break
+        return None
+
+    def items(self):
+        """
+        Generator that reads every term of the lexicon, in order.
+
+        :returns: generator of pairs (term, entry), as in find
+        :rtype: generator<tuple<str, tuple<str, int, int, int, float, int, int, int>>>
+        """
+        for block in range(self.numBlocks):
+            for term, entry in self.readBlock(block):
+                yield str(term, "utf-8"), entry
+
+    def close(self):
+        """
+        Function that unmaps and closes the lexicon file.
+        """
+        self.buf.close()
+        self.file.close()
+
+
+def openLexicon(inputFolder):
+    """
+    Function that opens the lexicon of an index, if it has one.
+
+    :param inputFolder: name of the folder of the index
+    :type inputFolder: str
+    :returns: the lexicon reader, None if the index has no lexicon
+    :rtype: LexiconReader
+    """
+    if not os.path.exists(inputFolder+"/"+LEXICONFILE):
+        return None
+    return LexiconReader(inputFolder+"/"+LEXICONFILE)
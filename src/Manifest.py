@@ -0,0 +1,208 @@
+"""
+.. module:: Manifest
+    :noindex:
+.. moduleauthor:: Filipe Pires [85122] & Joao Alegria [85048]
+"""
+import os
+import bisect
+import hashlib
+
+import BinaryIndex
+
+# name of the manifest file, written in the index folder next to the partitions and the lexicon
+MANIFESTFILE = "_manifest"
+# identifies the manifest files
+MANIFESTMAGIC = b"RIMANIFEST1"
+# bits of the Bloom filter of each partition per term, with BLOOMHASHES it gives about 1% of false positives
+BLOOMBITS = 10
+# number of bits set for each term in the Bloom filters
+BLOOMHASHES = 7
+
+
+class BloomFilter:
+    """
+    Class that implements a Bloom filter over the terms of a partition: a term that isn't in the partition is rejected without reading it, except for a small rate of false positives.
+    The bits of each term are given by double hashing a BLAKE2 digest of the term (the built-in hash of strings changes between executions, so it can't be persisted).
+
+    :param size: number of bytes of the filter
+    :type size: int
+    :param hashes: number of bits set for each term
+    :type hashes: int
+    :param bits: contents of the filter, None for an empty one
+    :type bits: bytes
+    """
+
+    def __init__(self, size, hashes=BLOOMHASHES, bits=None):
+        """
+        Class constructor
+        """
+        self.hashes = hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray(size)
+        self.size = len(self.bits)*8
+
+    def positions(self, term):
+        """
+        Auxiliary function that calculates the bits of a term.
+
+        :param term: the term
+        :type term: str
+        :returns: generator of the positions of the bits
+        :rtype: generator<int>
+        """
+        digest = hashlib.blake2b(term.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1+i*h2) % self.size for i in range(self.hashes))
+
+    def add(self, term):
+        """
+        Function that adds a term to the filter.
+
+        :param term: the term
+        :type term: str
+        """
+        for position in self.positions(term):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, term):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(term))
+
+
+class ManifestWriter:
+    """
+    Class that writes the manifest of an index: for each partition, in order, its name, its first and last terms, its size in bytes, its number of terms and the Bloom filter of its terms.
+    The terms are given one by one, as they are written, and a partition is finished when a term of another one arrives.
+
+    :param outputFolder: name of the folder where the index is written
+    :type outputFolder: str
+    """
+
+    def __init__(self, outputFolder):
+        """
+        Class constructor
+        """
+        self.file = open(outputFolder+"/"+MANIFESTFILE, "wb")
+        self.file.write(MANIFESTMAGIC)
+        self.partition = None
+        self.terms = []
+        self.size = 0
+
+    def add(self, term, filename, end):
+        """
+        Function that adds a term to the manifest, the terms being added in order.
+
+        :param term: the term
+        :type term: str
+        :param filename: name of the partition where the term was written
+        :type filename: str
+        :param end: position after the term in the partition, in bytes
+        :type end: int
+        """
+        filename = os.path.basename(filename)
+        if filename != self.partition:
+            self.flushPartition()
+            self.partition = filename
+        self.terms.append(term)
+        self.size = end
+
+    def flushPartition(self):
+        """
+        Auxiliary function that writes the entry of the current partition to the file.
+        """
+        if self.partition is None:
+            return
+        bloom = BloomFilter((len(self.terms)*BLOOMBITS+7)//8)
+        for term in self.terms:
+            bloom.add(term)
+        entry = bytearray()
+        for name in (self.partition, self.terms[0], self.terms[-1]):
+            name = name.encode("utf-8")
+            BinaryIndex.writeVarint(entry, len(name))
+            entry += name
+        BinaryIndex.writeVarint(entry, self.size)
+        BinaryIndex.writeVarint(entry, len(self.terms))
+        BinaryIndex.writeVarint(entry, bloom.hashes)
+        BinaryIndex.writeVarint(entry, len(bloom.bits))
+        entry += bloom.bits
+        self.file.write(entry)
+        self.partition = None
+        self.terms = []
+        self.size = 0
+
+    def close(self):
+        """
+        Function that writes the last partition and closes the manifest file.
+        """
+        self.flushPartition()
+        self.file.close()
+
+
+class Manifest:
+    """
+    Class that loads the manifest written by ManifestWriter, which is small enough to be kept in memory, and tells in which partition a term can be.
+
+    :param filename: name of the manifest file
+    :type filename: str
+    """
+
+    def __init__(self, filename):
+        """
+        Class constructor
+        """
+        f = open(filename, "rb")
+        buf = f.read()
+        f.close()
+        assert buf[:len(MANIFESTMAGIC)] == MANIFESTMAGIC, "Error: " + \
+            filename+" isn't a manifest"
+        self.partitions = []
+        self.firstTerms = []
+        self.lastTerms = []
+        self.sizes = []
+        self.numTerms = []
+        self.blooms = []
+        pos = len(MANIFESTMAGIC)
+        while pos < len(buf):
+            names = []
+            for i in range(3):
+                length, pos = BinaryIndex.readVarint(buf, pos)
+                names.append(str(buf[pos:pos+length], "utf-8"))
+                pos += length
+            size, pos = BinaryIndex.readVarint(buf, pos)
+            numTerms, pos = BinaryIndex.readVarint(buf, pos)
+            hashes, pos = BinaryIndex.readVarint(buf, pos)
+            length, pos = BinaryIndex.readVarint(buf, pos)
+            self.partitions.append(names[0])
+            self.firstTerms.append(names[1])
+            self.lastTerms.append(names[2])
+            self.sizes.append(size)
+            self.numTerms.append(numTerms)
+            self.blooms.append(BloomFilter(length, hashes, buf[pos:pos+length]))
+            pos += length
+
+    def find(self, term):
+        """
+        Function that finds the partition that can have a term: the one whose range of terms includes it, as long as its Bloom filter doesn't reject it.
+
+        :param term: the term
+        :type term: str
+        :returns: name of the partition, None if the term surely isn't in the index
+        :rtype: str
+        """
+        i = bisect.bisect_right(self.firstTerms, term)-1
+        if i < 0 or term > self.lastTerms[i] or term not in self.blooms[i]:
+            return None
+        return self.partitions[i]
+
+
+def openManifest(inputFolder):
+    """
+    Function that loads the manifest of an index, if it has one.
+
+    :param inputFolder: name of the folder of the index
+    :type inputFolder: str
+    :returns: the manifest, None if the index has no manifest
+    :rtype: Manifest
+    """
+    if not os.path.exists(inputFolder+"/"+MANIFESTFILE):
+        return None
+    return Manifest(inputFolder+"/"+MANIFESTFILE)
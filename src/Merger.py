@@ -6,15 +6,27 @@
 import io
 import os
 import math
+import mmap
+import heapq
+from operator import itemgetter
 from abc import ABC, abstractmethod
 from decimal import *
 
+import BinaryIndex
+import IndexWriter
+import Lexicon
+import Manifest
+
 getcontext().prec = 2
 
+# number of terms merged in memory before being given to the writer, which has its own buffer of IndexWriter.WRITEBUFFER bytes
+MERGEBATCH = 1000
+
 
 class Merger(ABC):
     """
-    Abstract class and interface for several types of index merging implementations, due to file format or processing method
+    Abstract class and interface for several types of index merging implementations, due to file format or processing method.
+    The merged terms are written through a single IndexWriter.PartitionWriter, kept open until the end, so the partitions of the final index are only given by the file limit.
 
     :param intermediateIndex: list of the names of the intermedia indexes to be merged
     :type intermediateIndex: list<str>
@@ -22,24 +34,53 @@ class Merger(ABC):
     :type totalNumDocs: int
     :param outputFolder: name of the folder where to store the final index
     :type outputFolder: str
+    :param separatePositions: True if the positions of the final index are to be written to their own file (see IndexWriter.POSITIONSFILE) instead of after each posting
+    :type separatePositions: bool
+    :param runFile: name of the file where the merge is written as a new intermediate index (in the same format, to be merged with others later), None to write the final index
+    :type runFile: str
+    :param championsSize: number of postings of the champions tier of each term, given to the lexicon
+    :type championsSize: int
     """
 
-    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit):
+    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit, separatePositions=False, runFile=None, championsSize=Lexicon.CHAMPIONSTIER):
         """
         Class constructor
         """
         # self.out = open(filename, "w")
         self.outFolder = outputFolder
-        if not os.path.exists(self.outFolder):
-            os.makedirs(self.outFolder)
-        else:
-            for f in [f for f in os.listdir(self.outFolder)]:
-                os.remove(self.outFolder+"/"+f)
-        self.files = [io.open(x, "r") for x in intermediateIndex]
+        self.runFile = runFile
+        self.writer = None
+        self.positionsWriter = None
+        self.lexicon = None
+        self.manifest = None
+        if runFile is None:
+            if not os.path.exists(self.outFolder):
+                os.makedirs(self.outFolder)
+            else:
+                for f in [f for f in os.listdir(self.outFolder)]:
+                    os.remove(self.outFolder+"/"+f)
+            if separatePositions:
+                self.positionsWriter = IndexWriter.PartitionWriter(
+                    self.outFolder, overrideFile=self.outFolder+"/"+IndexWriter.POSITIONSFILE)
+            self.lexicon = Lexicon.LexiconWriter(
+                self.outFolder, totalNumDocs, separatePositions, championsSize)
+            self.manifest = Manifest.ManifestWriter(self.outFolder)
+        self.files = [self.openBlock(x) for x in intermediateIndex]
         self.index = []
         self.fileLimit = fileLimit
         self.totalNumDocs = totalNumDocs
 
+    def openBlock(self, filename):
+        """
+        Function that opens one of the intermediate indexes to be read.
+
+        :param filename: name of the intermediate index
+        :type filename: str
+        :returns: the opened intermediate index
+        :rtype: file
+        """
+        return io.open(filename, "r")
+
     @abstractmethod
     def mergeIndex(self):
         """
@@ -54,6 +95,71 @@ class Merger(ABC):
         """
         pass
 
+    def openWriter(self, header=None, compress=False, separator=";"):
+        """
+        Auxiliary function that gives the writer of the merged terms, created in the first write: the partitions of the final index or the single file of a new intermediate index.
+
+        :param header: header of each file of a binary index, None for a text index
+        :type header: bytes
+        :param compress: True if the records of the new intermediate index are to be compressed
+        :type compress: bool
+        :param separator: separator of the postings of a text index
+        :type separator: str
+        :returns: the writer
+        :rtype: IndexWriter.PartitionWriter
+        """
+        if self.writer is None:
+            if self.runFile is None:
+                self.writer = IndexWriter.PartitionWriter(
+                    self.outFolder, self.fileLimit, lexicon=self.lexicon, header=header, manifest=self.manifest, separator=separator)
+            else:
+                self.writer = IndexWriter.PartitionWriter(
+                    self.outFolder, overrideFile=self.runFile, header=header, compress=compress, separator=separator)
+        return self.writer
+
+    def writeLines(self):
+        """
+        Auxiliary function that writes the terms merged so far, as triples (term, number of postings, postings joined by self.separator), as lines of a text index, starting with the idf of the term if self.weights is set.
+        Each line is built with a single join and, when the positions are kept in their own file, they are cut from the end of each posting and written there, in the same order.
+        """
+        writer = self.openWriter(separator=self.separator)
+        for t, df, postings in self.index:
+            head = t+":"+str(round(math.log10(self.totalNumDocs/df), 2)) if self.weights else t
+            if self.positionsWriter is None:
+                writer.write(t, head+self.separator+postings+"\n", df)
+            else:
+                postings = postings.split(self.separator)
+                cuts = [posting.rfind(":") for posting in postings]
+                positions = self.positionsWriter.write(
+                    t, ";".join([posting[cut+1:] for posting, cut in zip(postings, cuts)])+"\n", df)
+                writer.write(t, self.separator.join([head]+[posting[:cut] for posting, cut in zip(postings, cuts)])+"\n",
+                             df, positions=positions)
+        self.index = []
+
+    def merge(self):
+        """
+        Function that merges all the intermediate indexes, writing the merged terms every MERGEBATCH terms, and closes the merger.
+        The memory used is bounded by the batch of terms and the buffer of the writer, whatever the size of the index.
+        """
+        while not self.mergeIndex():
+            if len(self.index) >= MERGEBATCH:
+                self.writeIndex()
+        self.writeIndex()
+        self.close()
+
+    def close(self):
+        """
+        Function that closes the writer and the lexicon, the manifest and the positions file of the final index, to be called after the last write.
+        """
+        if self.writer:
+            self.writer.close()
+        if self.runFile is not None:
+            return
+        self.lexicon.close()
+        self.manifest.close()
+        if self.positionsWriter:
+            self.positionsWriter.close()
+
     '''
     def clearVar(self):
         """
@@ -63,261 +169,272 @@ class Merger(ABC):
     '''
 
 
-class PositionWeightMerger(Merger):
-    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit):
+class CSVMerger(Merger):
+    """
+    Base of the mergers of the text formats, which merges the intermediate indexes with a heap (priority queue) of their current lines, ordered by term and then by intermediate index.
+    Each call of mergeIndex pops all the lines of the smallest term and reads the next line of only those intermediate indexes, so merging costs O(log k) per line instead of a scan of the k intermediate indexes per term.
+    The postings ("docID:value[:positions]") are kept as the text that was read: a term present in a single intermediate index keeps its postings as they are, already sorted, and the postings of the others are only sorted by their value, which is parsed once.
+    The subclasses define the separator of the postings and if the line starts with the idf of the term. When the positions are kept in their own file, they are cut from the end of each posting and written there, in the same order.
+    """
+    # separator of the postings in each line
+    separator = ";"
+    # flag that indicates if the idf follows the term
+    weights = False
+
+    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit, separatePositions=False, runFile=None, championsSize=Lexicon.CHAMPIONSTIER):
         """
         Class constructor
         """
-        super().__init__(intermediateIndex, totalNumDocs, outputFolder, fileLimit)
-        self.terms = [x.readline().strip().split(";") for x in self.files]
+        super().__init__(intermediateIndex, totalNumDocs,
+                         outputFolder, fileLimit, separatePositions, runFile, championsSize)
+        # tuples (term, number of the intermediate index, postings of the line)
+        self.heap = []
+        for idx in range(len(self.files)):
+            self.readLine(idx)
+
+    def readLine(self, idx):
+        """
+        Auxiliary function that reads the next line of an intermediate index into the heap, or closes and removes the intermediate index when it has no more lines.
+
+        :param idx: number of the intermediate index
+        :type idx: int
+        """
+        line = self.files[idx].readline()
+        if line == "":
+            self.files[idx].close()
+            os.remove(self.files[idx].name)
+            return
+        cut = line.find(self.separator)
+        term = line[:line.find(":")] if self.weights else line[:cut]
+        heapq.heappush(self.heap, (term, idx, line[cut+1:].rstrip("\n")))
 
     def mergeIndex(self):
         """
-        Variation of the merge function adapted to the positions and weights format.
+        Function that merges the next term of the intermediate indexes, keeping its postings in self.index.
         """
-        if self.files == []:
+        if self.heap == []:
             return True
-        if "" in self.terms:
-            line = self.files[self.terms.index(
-                "")].readline().strip().split(";")
-            if line == [""]:
-                os.remove(self.files[self.terms.index("")].name)
-                self.files.remove(self.files[self.terms.index("")])
-                self.terms.remove(self.terms[self.terms.index("")])
-                return False
-            self.terms[self.terms.index("")] = line
+        term, idx, postings = heapq.heappop(self.heap)
+        if self.heap == [] or self.heap[0][0] != term:
+            self.index.append((term, postings.count(self.separator)+1, postings))
+            self.readLine(idx)
             return False
-
-        term = min([x[0][:x[0].find(":")] for x in self.terms])
-        self.index.append([term, {}])
-        for idx, t in enumerate(self.terms):
-            if term == t[0][:t[0].find(":")]:
-                for d in t[1:]:
-                    self.index[-1][1][d.split(":")[0]] = [d.split(":")
-                                                          [1], d.split(":")[2].split(",")]
-                self.terms[idx] = ""
-
+        merged = postings.split(self.separator)
+        blocks = [idx]
+        while self.heap != [] and self.heap[0][0] == term:
+            _, idx, postings = heapq.heappop(self.heap)
+            merged += postings.split(self.separator)
+            blocks.append(idx)
+        for idx in blocks:
+            self.readLine(idx)
+        # stable, so postings with the same value keep the order of the intermediate indexes
+        value = float if self.weights else int
+        merged.sort(key=lambda posting: value(
+            posting.split(":", 2)[1]), reverse=True)
+        self.index.append((term, len(merged), self.separator.join(merged)))
         return False
 
     def writeIndex(self):
         """
-        Variation of the write function adapted to the positions and weights format.
+        Function that writes the terms merged so far to the final index, through the writer of the merger (see writeLines).
         """
         if self.index == []:
             return
-        self.index.sort(key=lambda tup: tup[0])
-        filenameTemplate = self.outFolder + "/{}"
-        out = open(filenameTemplate.format(self.index[0][0]), "w")
-        auxString = ""
-        count = 0
-        idx = 0
-        for t, docs in self.index:
-            auxString += t+":" + \
-                str(round(math.log10(self.totalNumDocs/len(docs)), 2))
-            for doc, w in sorted(docs.items(), key=lambda tup: tup[1], reverse=True):
-                auxString += ";"+doc+":" + w[0] + ":" + \
-                    str(w[1][0])+"".join(","+x for x in w[1][1:])
-            count += len(auxString)
-            out.write(auxString+"\n")
-            auxString = ""
-            if count > self.fileLimit:
-                out.close()
-                out = open(filenameTemplate.format(self.index[idx][0]), "w")
-                count = 0
-            idx += 1
-        self.index = []
-        out.close()
+        self.writeLines()
 
 
-class WeightMerger(Merger):
-    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit):
-        """
-        Class constructor
-        """
-        super().__init__(intermediateIndex, totalNumDocs, outputFolder, fileLimit)
-        self.terms = [x.readline().strip().split(";") for x in self.files]
+class PositionWeightMerger(CSVMerger):
+    """
+    Implementation of the merger for the positions and weights format.
+    """
+    weights = True
 
-    def mergeIndex(self):
-        """
-        Variation of the merge function adapted to the weights format.
-        """
-        if self.files == []:
-            return True
-        if "" in self.terms:
-            line = self.files[self.terms.index(
-                "")].readline().strip().split(";")
-            if line == [""]:
-                os.remove(self.files[self.terms.index("")].name)
-                self.files.remove(self.files[self.terms.index("")])
-                self.terms.remove(self.terms[self.terms.index("")])
-                return False
-            self.terms[self.terms.index("")] = line
-            return False
 
-        term = min([x[0][:x[0].find(":")] for x in self.terms])
-        self.index.append([term, {}])
-        for idx, t in enumerate(self.terms):
-            if term == t[0][:t[0].find(":")]:
-                for d in t[1:]:
-                    self.index[-1][1][d.split(":")[0]] = d.split(":")[1]
-                self.terms[idx] = ""
+class WeightMerger(CSVMerger):
+    """
+    Implementation of the merger for the weights format.
+    """
+    weights = True
 
-        return False
 
-    def writeIndex(self):
-        """
-        Variation of the write function adapted to the weights format.
-        """
-        if self.index == []:
-            return
-        self.index.sort(key=lambda tup: tup[0])
-        filenameTemplate = self.outFolder + "/{}"
-        out = open(filenameTemplate.format(self.index[0][0]), "w")
-        auxString = ""
-        count = 0
-        idx = 0
-        for t, docs in self.index:
-            auxString += t+":" + \
-                str(round(math.log10(self.totalNumDocs/len(docs)), 2))
-            for doc, w in sorted(docs.items(), key=lambda tup: tup[1], reverse=True):
-                auxString += ";"+doc+":" + w
-            count += len(auxString)
-            out.write(auxString+"\n")
-            auxString = ""
-            if count > self.fileLimit:
-                out.close()
-                out = open(filenameTemplate.format(self.index[idx][0]), "w")
-                count = 0
-            idx += 1
-        self.index = []
-        out.close()
+class PositionMerger(CSVMerger):
+    """
+    Implementation of the merger for the positions format.
+    """
+    pass
 
 
-class PositionMerger(Merger):
-    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit):
+class SimpleMerger(CSVMerger):
+    """
+    Implementation of the merger for the assignment's 1 format.
+    """
+    separator = ","
+
+
+class BinaryMerger(Merger):
+    """
+    Implementation of the merger for the binary format (see BinaryIndex). The intermediate indexes are mapped in memory and read record by record, through a heap of their current records (as in CSVMerger).
+    The records of terms present in a single intermediate index are copied as they are, only their idf is calculated, the others are decoded, joined and encoded again.
+    The intermediate indexes can have their records compressed in chunks (see BinaryIndex.COMPRESSEDFLAG), which are decompressed one at a time; the final index never is.
+    """
+
+    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit, separatePositions=False, runFile=None, championsSize=Lexicon.CHAMPIONSTIER):
         """
         Class constructor
         """
-        super().__init__(intermediateIndex, totalNumDocs, outputFolder, fileLimit)
-        self.positionIndex = {}
-        self.terms = [x.readline().strip().split(";") for x in self.files]
+        super().__init__(intermediateIndex, totalNumDocs,
+                         outputFolder, fileLimit, separatePositions, runFile, championsSize)
+        # the format of the final index is the one of the intermediate indexes, given by the flags in their header
+        flags = self.files[0][1][len(BinaryIndex.BINMAGIC)]
+        self.weights = bool(flags & BinaryIndex.WEIGHTSFLAG)
+        self.positions = bool(flags & BinaryIndex.POSITIONSFLAG)
+        self.compressed = bool(flags & BinaryIndex.COMPRESSEDFLAG)
+        if runFile is None:
+            flags &= ~BinaryIndex.COMPRESSEDFLAG
+        self.header = BinaryIndex.BINMAGIC + bytes([flags])
+        # tuples (term, number of the intermediate index, buffer of the record, position of the rest of the record, position after the record)
+        self.heap = []
+        for idx in range(len(self.files)):
+            self.readRecord(idx)
+
+    def openBlock(self, filename):
+        """
+        Function that maps one of the intermediate indexes in memory.
+
+        :returns: list with the file, its memory map and the generator of its records
+        :rtype: list
+        """
+        f = io.open(filename, "rb")
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buf[len(BinaryIndex.BINMAGIC)] & BinaryIndex.COMPRESSEDFLAG:
+            return [f, buf, BinaryIndex.readCompressedRecords(buf)]
+        return [f, buf, ((buf, term, start, end) for term, start, end in BinaryIndex.readRecords(buf))]
+
+    def readRecord(self, idx):
+        """
+        Auxiliary function that reads the next record of an intermediate index into the heap, or closes and removes the intermediate index when it has no more records.
+
+        :param idx: number of the intermediate index
+        :type idx: int
+        """
+        f, buf, records = self.files[idx]
+        record = next(records, None)
+        if record is None:
+            buf.close()
+            f.close()
+            os.remove(f.name)
+            return
+        chunk, term, start, end = record
+        heapq.heappush(self.heap, (term, idx, chunk, start, end))
 
     def mergeIndex(self):
         """
-        Variation of the merge function adapted to the positions format.
+        Variation of the merge function adapted to the binary format.
         """
-        if self.files == []:
+        if self.heap == []:
             return True
-        if "" in self.terms:
-            line = self.files[self.terms.index(
-                "")].readline().strip().split(";")
-            if line == [""]:
-                os.remove(self.files[self.terms.index("")].name)
-                self.files.remove(self.files[self.terms.index("")])
-                self.terms.remove(self.terms[self.terms.index("")])
-                return False
-            self.terms[self.terms.index("")] = line
-            return False
-
-        term = min([x[0] for x in self.terms])
-        self.index.append([term, {}])
-        for idx, t in enumerate(self.terms):
-            if t[0] == term:
-                for d in t[1:]:
-                    self.index[-1][1][d.split(":")
-                                      [0]] = [d.split(":")[1], d.split(":")[2].split(",")]
-                self.terms[idx] = ""
+        records = [heapq.heappop(self.heap)]
+        term = records[0][0]
+        while self.heap != [] and self.heap[0][0] == term:
+            records.append(heapq.heappop(self.heap))
+        blocks = [idx for _, idx, _, _, _ in records]
+        bufs = [buf for _, _, buf, _, _ in records]
+        ends = [end for _, _, _, _, end in records]
+        headers = [BinaryIndex.readHeader(buf, start) for _, _, buf, start, _ in records]
+        df = sum(header[1] for header in headers)
+        idf = 0
+        if self.weights:
+            idf = round(round(math.log10(self.totalNumDocs/df), 2)*BinaryIndex.QUANTUM)
+        if len(blocks) == 1:
+            buf = bufs[0]
+            _, _, start, end = headers[0]
+            record = BinaryIndex.encodeRecord(term, idf, df, buf[start:end], buf[end:ends[0]])
+        else:
+            postings = []
+            for buf, (_, _, start, end), recordEnd in zip(bufs, headers, ends):
+                values = BinaryIndex.decodePostings(buf, start, end)
+                if self.positions:
+                    postings += [(value, docID, positions) for (value, docID), positions in zip(
+                        values, BinaryIndex.decodePositions(buf, end, recordEnd))]
+                else:
+                    postings += [(value, docID, None) for value, docID in values]
+            postings.sort(key=lambda tup: (-tup[0], tup[1]))
+            record = BinaryIndex.encodeTerm(term, idf, postings)
+        self.index.append((term, record))
+        for idx in blocks:
+            self.readRecord(idx)
 
         return False
 
     def writeIndex(self):
         """
-        Variation of the write function adapted to the positions format.
+        Variation of the write function adapted to the binary format.
         """
         if self.index == []:
             return
-        self.index.sort(key=lambda tup: tup[0])
-        filenameTemplate = self.outFolder + "/{}"
-        out = open(filenameTemplate.format(self.index[0][0]), "w")
-        auxString = ""
-        count = 0
-        idx = 0
-        for t, docs in self.index:
-            auxString += t
-            for doc, w in sorted(docs.items(), key=lambda tup: tup[1], reverse=True):
-                auxString += ";"+doc+":" + \
-                    str(w[0])+":" + str(w[1][0])+"".join(","+str(x)
-                                                         for x in w[1][1:])
-            count += len(auxString)
-            out.write(auxString+"\n")
-            auxString = ""
-            if count > self.fileLimit:
-                out.close()
-                out = open(filenameTemplate.format(self.index[idx][0]), "w")
-                count = 0
-            idx += 1
+        writer = self.openWriter(self.header, self.compressed)
+        for t, record in self.index:
+            df, start, end = BinaryIndex.recordPostings(record)
+            writer.write(t, record, df, start, end)
         self.index = []
-        out.close()
 
 
-class SimpleMerger(Merger):
-    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit):
+class CSVBlockMerger(BinaryMerger):
+    """
+    Implementation of the merger that writes a text index from intermediate indexes in the binary format (see PersistIndex.persistBlock), which are smaller and faster to read and write than text ones.
+    The records of each term are decoded by groups of postings with the same value, each group is turned into text with a single join and the groups of the intermediate indexes are sorted by value (in the order of the intermediate indexes for the same value, so the docIDs stay increasing).
+    The lines are written as in CSVMerger.
+    """
+
+    def __init__(self, intermediateIndex, totalNumDocs, outputFolder, fileLimit, separatePositions=False, championsSize=Lexicon.CHAMPIONSTIER):
         """
         Class constructor
         """
-        super().__init__(intermediateIndex, totalNumDocs, outputFolder, fileLimit)
-        self.terms = [x.readline().strip().split(",") for x in self.files]
+        super().__init__(intermediateIndex, totalNumDocs,
+                         outputFolder, fileLimit, separatePositions, championsSize=championsSize)
+        # the assignment's 1 format is the only one separated by commas
+        self.separator = ";" if self.weights or self.positions else ","
 
     def mergeIndex(self):
         """
-        Variation of the merge function adapted to the assignment's 1 format.
+        Variation of the merge function that keeps the postings of each term as text, as CSVMerger does.
         """
-        if self.files == []:
+        if self.heap == []:
             return True
-        if "" in self.terms:
-            line = self.files[self.terms.index(
-                "")].readline().strip().split(",")
-            if line == [""]:
-                os.remove(self.files[self.terms.index("")].name)
-                self.files.remove(self.files[self.terms.index("")])
-                self.terms.remove(self.terms[self.terms.index("")])
-                return False
-            self.terms[self.terms.index("")] = line
-            return False
-
-        term = min([x[0] for x in self.terms])
-        self.index.append([term, {}])
-        for idx, t in enumerate(self.terms):
-            if t[0] == term:
-                for d in t[1:]:
-                    self.index[-1][1][d.split(":")[0]] = d.split(":")[1]
-                self.terms[idx] = ""
-
+        records = [heapq.heappop(self.heap)]
+        term = records[0][0]
+        while self.heap != [] and self.heap[0][0] == term:
+            records.append(heapq.heappop(self.heap))
+        df = 0
+        separator = self.separator
+        # pairs (value, postings of the group as text) of all the intermediate indexes
+        groups = []
+        for _, _, buf, start, recordEnd in records:
+            _, count, start, end = BinaryIndex.readHeader(buf, start)
+            df += count
+            if self.positions:
+                positions = BinaryIndex.decodePositions(buf, end, recordEnd)
+                first = 0
+            for value, docIDs in BinaryIndex.decodeGroups(buf, start, end):
+                text = ":"+str(value/BinaryIndex.QUANTUM if self.weights else value)
+                if self.positions:
+                    groups.append((value, separator.join([str(docID)+text+":"+",".join(map(str, docPositions))
+                                                          for docID, docPositions in zip(docIDs, positions[first:first+len(docIDs)])])))
+                    first += len(docIDs)
+                else:
+                    groups.append((value, (text+separator).join(map(str, docIDs))+text))
+        # stable, so the groups with the same value keep the order of the intermediate indexes, and so increasing docIDs
+        if len(records) > 1:
+            groups.sort(key=itemgetter(0), reverse=True)
+        self.index.append((term, df, separator.join([text for _, text in groups])))
+        for _, idx, _, _, _ in records:
+            self.readRecord(idx)
         return False
 
     def writeIndex(self):
         """
-        Variation of the write function adapted to the assignment's 1 format.
+        Variation of the write function that writes the lines of the text format (see Merger.writeLines).
         """
         if self.index == []:
             return
-        self.index.sort(key=lambda tup: tup[0])
-        filenameTemplate = self.outFolder + "/{}"
-        out = open(filenameTemplate.format(self.index[0][0]), "w")
-        auxString = ""
-        count = 0
-        idx = 0
-        for t, docs in self.index:
-            auxString += t
-            for doc, w in sorted(docs.items(), key=lambda tup: tup[1], reverse=True):
-                auxString += ","+doc+":" + str(w)
-            count += len(auxString)
-            out.write(auxString+"\n")
-            auxString = ""
-            if count > self.fileLimit:
-                out.close()
-                out = open(filenameTemplate.format(self.index[idx][0]), "w")
-                count = 0
-            idx += 1
-        self.index = []
-        out.close()
+        self.writeLines()
@@ -9,6 +9,11 @@ import os
 import math
 from abc import ABC, abstractmethod
 
+import BinaryIndex
+import IndexWriter
+import Lexicon
+import Manifest
+
 LIMITCACHE = 5
 
 
@@ -22,9 +27,22 @@ class PersistIndex(ABC):
     :type indexer: Indexer
     :param totalNumDocs: total number of documents needed if the weights need to be calculated
     :type totalNumDocs: int
+    :param translationFilename: name of the file where the index metadata is written, None for indexMetadata.txt next to the output folder
+    :type translationFilename: str
+    :param cacheFilename: name of the file where the documents cache is written, None for ../docCache
+    :type cacheFilename: str
+    :param separatePositions: True if the positions of the final index are to be written to their own file (see IndexWriter.POSITIONSFILE) instead of after each posting
+    :type separatePositions: bool
+    :param compressBlocks: True if the intermediate indexes are to be written in the binary format compressed with zlib, whatever the format of the final index
+    :type compressBlocks: bool
+    :param championsSize: number of postings of the champions tier of each term, given to the lexicon
+    :type championsSize: int
     """
+    # flags of the format, given by the subclasses, used for the binary records
+    weights = False
+    positions = False
 
-    def __init__(self, outputFolder, fileLimit=float("inf"), indexer=None, totalNumDocs=1):
+    def __init__(self, outputFolder, fileLimit=float("inf"), indexer=None, totalNumDocs=1, translationFilename=None, cacheFilename=None, separatePositions=False, compressBlocks=False, championsSize=Lexicon.CHAMPIONSTIER):
         """
         Class constructor
         """
@@ -35,12 +53,19 @@ class PersistIndex(ABC):
             for f in [f for f in os.listdir(outputFolder)]:
                 os.remove(outputFolder+"/"+f)
         if indexer:
-            self.index = list(indexer.index.items())
+            self.index = indexer.items()
         self.totalNumDocs = totalNumDocs
         self.outputFolder = outputFolder
         self.fileLimit = fileLimit
-        self.translationFile = open(outputFolder+"/../indexMetadata.txt", "w")
-        self.cacheFile = open("../docCache", "w")
+        self.separatePositions = separatePositions
+        self.compressBlocks = compressBlocks
+        self.championsSize = championsSize
+        if translationFilename is None:
+            translationFilename = outputFolder+"/../indexMetadata.txt"
+        if cacheFilename is None:
+            cacheFilename = "../docCache"
+        self.translationFile = open(translationFilename, "w")
+        self.cacheFile = open(cacheFilename, "w")
 
     def setTotalNumDocs(self, totalNumDocs):
         """
@@ -56,10 +81,10 @@ class PersistIndex(ABC):
         Auxiliary function that persists the index metadata, i.e., the translation from internal ID to PMID(real document identifier).
 
         :param translations: list of translations.Ex: [(internalID, PMID),...]
-        :type translations: list<tuple<str, str>>
+        :type translations: list<tuple<int, str>>
         """
         for t in translations:
-            self.translationFile.write(t[0]+","+t[1]+"\n")
+            self.translationFile.write(str(t[0])+","+t[1]+"\n")
 
     def persistCache(self, docID, bestTerms):
         """
@@ -77,9 +102,14 @@ class PersistIndex(ABC):
     def persist(self, index=None, overrideFile=None):
         """
         Function that effectively persists the data.
+
+        :param index: pairs (term, postings) to be persisted, as returned by Indexer.items(), None to persist the index given in the constructor
+        :type index: list<tuple<str, Postings>>
+        :param overrideFile: name of the single file to be written (used for the intermediate indexes), None to write partitions into the output folder
+        :type overrideFile: str
         """
         if index:
-            self.index = list(index.items())
+            self.index = list(index)
         if overrideFile:
             self.currentFilename = overrideFile
         else:
@@ -87,6 +117,94 @@ class PersistIndex(ABC):
         if self.index == []:
             return False
         print("Persisting...")
+        # the lexicon and the manifest are only written for the final index, not for the intermediate ones, which also keep the positions after each posting for the merge
+        self.positionsWriter = None
+        if self.separatePositions and not overrideFile:
+            self.positionsWriter = IndexWriter.PartitionWriter(
+                self.outputFolder, overrideFile=self.outputFolder+"/"+IndexWriter.POSITIONSFILE)
+        self.lexicon = None if overrideFile else Lexicon.LexiconWriter(
+            self.outputFolder, self.totalNumDocs, self.positionsWriter is not None, self.championsSize)
+        self.manifest = None if overrideFile else Manifest.ManifestWriter(
+            self.outputFolder)
+
+    def persistBlock(self, overrideFile):
+        """
+        Function that persists the index as an intermediate index in the binary format (see BinaryIndex), with its records compressed with zlib in chunks, which the mergers read whatever the format of the final index.
+
+        :param overrideFile: name of the intermediate index
+        :type overrideFile: str
+        :returns: True, since the index isn't empty
+        :rtype: bool
+        """
+        self.index.sort(key=lambda tup: tup[0])
+        header = BinaryIndex.BINMAGIC + bytes([(BinaryIndex.WEIGHTSFLAG if self.weights else 0) |
+                                               (BinaryIndex.POSITIONSFLAG if self.positions else 0) | BinaryIndex.COMPRESSEDFLAG])
+        writer = IndexWriter.PartitionWriter(
+            self.outputFolder, overrideFile=overrideFile, header=header, compress=True)
+        for token, freqs in self.index:
+            writer.write(token, self.encodeTerm(token, freqs, False), len(freqs))
+        writer.close()
+        self.index = []
+        return True
+
+    def encodeTerm(self, token, freqs, final=True):
+        """
+        Auxiliary function that builds the binary record of one term, with its postings sorted by decreasing value and increasing docID.
+
+        :param token: the term
+        :type token: str
+        :param freqs: postings of the term
+        :type freqs: Postings
+        :param final: False for the intermediate indexes, whose idf is only known when they are merged
+        :type final: bool
+        :returns: the record
+        :rtype: bytearray
+        """
+        docs = freqs.docs
+        idf = 0
+        if self.weights:
+            values = [round(w*BinaryIndex.QUANTUM) for w in freqs.weights]
+            if final:
+                idf = round(round(math.log10(self.totalNumDocs/len(freqs)), 2)*BinaryIndex.QUANTUM)
+        else:
+            values = freqs.tfs
+        # the documents are added in order and the sort is stable, so the postings with the same value keep increasing docIDs
+        order = sorted(range(len(docs)), key=values.__getitem__, reverse=True)
+        if self.positions:
+            positions = freqs.positions
+            offsets = freqs.offsets()
+            postings = [(values[i], docs[i], positions[offsets[i]:offsets[i+1]]) for i in order]
+        else:
+            postings = [(values[i], docs[i], None) for i in order]
+        return BinaryIndex.encodeTerm(token, idf, postings)
+
+    def writePositional(self, writer, token, head, postings, positions):
+        """
+        Auxiliary function that writes the line of a term of an index with positions: the positions of each posting follow it or, when they are kept apart, go to the positions file, in a line of their own with the same order as the postings.
+
+        :param writer: writer of the index
+        :type writer: IndexWriter.PartitionWriter
+        :param token: the term
+        :type token: str
+        :param head: beginning of the line, the term and its idf (if the weights are stored)
+        :type head: str
+        :param postings: postings of the term, in order, such as "docID:weight"
+        :type postings: list<str>
+        :param positions: positions of each posting, such as "pos1,pos2,..."
+        :type positions: list<str>
+        """
+        if self.positionsWriter is None:
+            writer.write(token, ";".join([head]+[posting+":"+docPositions for posting, docPositions in zip(postings, positions)])+"\n", len(postings))
+        else:
+            writer.write(token, ";".join([head]+postings)+"\n", len(postings),
+                         positions=self.positionsWriter.write(token, ";".join(positions)+"\n", len(postings)))
+
+    def close(self):
+        """
+        Function that closes the index metadata and documents cache files, making sure everything written to them is on disk.
+        """
+        self.translationFile.close()
+        self.cacheFile.close()
 
     def clearVar(self):
         """
@@ -109,29 +227,19 @@ class PersistCSV(PersistIndex):
         super().persist(index, overrideFile)
         if self.index == []:
             return False
+        if overrideFile and self.compressBlocks:
+            return self.persistBlock(overrideFile)
         self.index.sort(key=lambda tup: tup[0])
-        filenameTemplate = self.currentFilename + "/{}"
-        if not overrideFile:
-            self.currentFilename = filenameTemplate.format(self.index[0][0])
-        f = open(self.currentFilename, "w")
-        currStr = ""
-        count = 0
-        idx = 0
+        writer = IndexWriter.PartitionWriter(
+            self.outputFolder, self.fileLimit, overrideFile, self.lexicon, manifest=self.manifest, separator=",")
         for token, freqs in self.index:
-            currStr += token
-            for docID, countPositions in sorted(freqs.items(), key=lambda tup: tup[1], reverse=True):
-                currStr += ","+docID+":"+str(countPositions[0])
-            # batch-like writting, writting 1 token and its ocurrences at a time
-            count += len(currStr)
-            f.write(currStr+"\n")
-            currStr = ""
-            if not overrideFile:
-                if count > self.fileLimit:
-                    f.close()
-                    f = open(filenameTemplate.format(self.index[idx][0]), "w")
-                    count = 0
-            idx += 1
-        f.close()
+            docs = freqs.docs
+            tfs = freqs.tfs
+            writer.write(token, ",".join([token]+[f"{docs[i]}:{tfs[i]}" for i in freqs.sortedIndexes()])+"\n", len(freqs))
+        writer.close()
+        if self.lexicon:
+            self.lexicon.close()
+            self.manifest.close()
         self.index = []
         return True
 
@@ -148,35 +256,26 @@ class PersistCSVWeighted(PersistIndex):
         token1:idf1; docID1:tfw1; docID2:tfw2;...
         token2:idf2; docID1:tfw1; docID2:tfw2;...
     """
+    weights = True
 
     def persist(self, index=None, overrideFile=None):
         super().persist(index, overrideFile)
         if self.index == []:
             return False
+        if overrideFile and self.compressBlocks:
+            return self.persistBlock(overrideFile)
         self.index.sort(key=lambda tup: tup[0])
-        filenameTemplate = self.currentFilename + "/{}"
-        if not overrideFile:
-            self.currentFilename = filenameTemplate.format(self.index[0][0])
-        f = open(self.currentFilename, "w")
-        currStr = ""
-        count = 0
-        idx = 0
+        writer = IndexWriter.PartitionWriter(
+            self.outputFolder, self.fileLimit, overrideFile, self.lexicon, manifest=self.manifest)
         for token, freqs in self.index:
-            currStr += token+":" + \
-                str(round(math.log10(self.totalNumDocs/len(freqs)), 2))
-            for docID, countPositions in sorted(freqs.items(), key=lambda tup: tup[1], reverse=True):
-                currStr += ";"+docID+":" + str(countPositions[0])
-            # batch-like writting, writting 1 token and its ocurrences at a time
-            count += len(currStr)
-            f.write(currStr+"\n")
-            currStr = ""
-            if not overrideFile:
-                if count > self.fileLimit:
-                    f.close()
-                    f = open(filenameTemplate.format(self.index[idx][0]), "w")
-                    count = 0
-            idx += 1
-        f.close()
+            idf = round(math.log10(self.totalNumDocs/len(freqs)), 2)
+            docs = freqs.docs
+            weights = freqs.weights
+            writer.write(token, ";".join([f"{token}:{idf}"]+[f"{docs[i]}:{weights[i]}" for i in freqs.sortedIndexes()])+"\n", len(freqs))
+        writer.close()
+        if self.lexicon:
+            self.lexicon.close()
+            self.manifest.close()
         self.index = []
         return True
 
@@ -193,36 +292,31 @@ class PersistCSVPosition(PersistIndex):
         token1,docID1:docFreq1:pos1,pos2,...; docID2:docFreq2:pos1,pos2,...; ...
         token2,docID1:docFreq1:pos1,pos2,...; docID2:docFreq1:pos1,pos2,...; ...
     """
+    positions = True
 
     def persist(self, index=None, overrideFile=None):
         super().persist(index, overrideFile)
         if self.index == []:
             return False
+        if overrideFile and self.compressBlocks:
+            return self.persistBlock(overrideFile)
         self.index.sort(key=lambda tup: tup[0])
-        filenameTemplate = self.currentFilename + "/{}"
-        if not overrideFile:
-            self.currentFilename = filenameTemplate.format(self.index[0][0])
-        f = open(self.currentFilename, "w")
-        currStr = ""
-        count = 0
-        idx = 0
+        writer = IndexWriter.PartitionWriter(
+            self.outputFolder, self.fileLimit, overrideFile, self.lexicon, manifest=self.manifest)
         for token, freqs in self.index:
-            currStr += token
-            for docID, countPositions in sorted(freqs.items(), key=lambda tup: tup[1], reverse=True):
-                currStr += ";"+docID+":" + \
-                    str(countPositions[0])+":"+str(countPositions[1][0]) + \
-                    "".join(","+str(x) for x in countPositions[1][1:])
-            # batch-like writting, writting 1 token and its ocurrences at a time
-            count += len(currStr)
-            f.write(currStr+"\n")
-            currStr = ""
-            if not overrideFile:
-                if count > self.fileLimit:
-                    f.close()
-                    f = open(filenameTemplate.format(self.index[idx][0]), "w")
-                    count = 0
-            idx += 1
-        f.close()
+            docs = freqs.docs
+            tfs = freqs.tfs
+            positions = freqs.positions
+            offsets = freqs.offsets()
+            order = freqs.sortedIndexes()
+            self.writePositional(writer, token, token, [f"{docs[i]}:{tfs[i]}" for i in order],
+                                 [",".join(map(str, positions[offsets[i]:offsets[i+1]])) for i in order])
+        writer.close()
+        if self.positionsWriter:
+            self.positionsWriter.close()
+        if self.lexicon:
+            self.lexicon.close()
+            self.manifest.close()
         self.index = []
         return True
 
@@ -239,41 +333,34 @@ class PersistCSVWeightedPosition(PersistIndex):
         token1:idf1; docID1:tfw1:pos1,pos2,...; docID2:tfw2:...; ...
         token2:idf2; docID1:tfw1:pos1,pos2,...; docID2:tfw2:...; ...
     """
+    weights = True
+    positions = True
 
     def persist(self, index=None, overrideFile=None):
         super().persist(index, overrideFile)
         if self.index == []:
             return False
+        if overrideFile and self.compressBlocks:
+            return self.persistBlock(overrideFile)
         self.index.sort(key=lambda tup: tup[0])
-        filenameTemplate = self.currentFilename + "/{}"
-        if not overrideFile:
-            self.currentFilename = filenameTemplate.format(self.index[0][0])
-        f = open(self.currentFilename, "w")
-        currStr = ""
-        count = 0
-        idx = 0
+        writer = IndexWriter.PartitionWriter(
+            self.outputFolder, self.fileLimit, overrideFile, self.lexicon, manifest=self.manifest)
         for token, freqs in self.index:
-            currStr += token+":" + \
-                str(round(math.log10(self.totalNumDocs/len(freqs)), 2))
-            for docID, countPositions in sorted(freqs.items(), key=lambda tup: tup[1], reverse=True):
-                currStr += ";"+docID+":" + \
-                    str(countPositions[0])+":"+str(countPositions[1][0]) + \
-                    "".join(","+str(x) for x in countPositions[1][1:])
-            # batch-like writting, writting 1 token and its ocurrences at a time
-
-            count += len(currStr)
-            f.write(currStr+"\n")
-            currStr = ""
-            if not overrideFile:
-                if count > self.fileLimit:
-                    f.close()
-                    f = open(filenameTemplate.format(self.index[idx][0]), "w")
-                    count = 0
-            idx += 1
-        f.close()
-        del self.index
+            idf = round(math.log10(self.totalNumDocs/len(freqs)), 2)
+            docs = freqs.docs
+            weights = freqs.weights
+            positions = freqs.positions
+            offsets = freqs.offsets()
+            order = freqs.sortedIndexes()
+            self.writePositional(writer, token, f"{token}:{idf}", [f"{docs[i]}:{weights[i]}" for i in order],
+                                 [",".join(map(str, positions[offsets[i]:offsets[i+1]])) for i in order])
+        writer.close()
+        if self.positionsWriter:
+            self.positionsWriter.close()
+        if self.lexicon:
+            self.lexicon.close()
+            self.manifest.close()
         self.index = []
-
         return True
 
     def clearVar(self):
@@ -281,3 +368,59 @@ class PersistCSVWeightedPosition(PersistIndex):
         Function that frees the memory currently in use by emptying all class variables.
         """
         self.index = []
+
+
+class PersistBinary(PersistIndex):
+    """
+    Implementation of the index persister that writes the index in a compressed binary format (see BinaryIndex), instead of text. Each file starts with a magic number and the flags of the format, followed by one record for each term:
+        term, idf, number of postings, postings grouped by value (docID gaps packed in 1, 2 or 4 bytes), positions of each posting
+    This instance persists only the term frequencies, its subclasses choose between weights and frequencies and if the positions are persisted.
+    """
+
+    def persist(self, index=None, overrideFile=None):
+        """
+        Function that effectively persists the data in the binary format.
+        """
+        super().persist(index, overrideFile)
+        if self.index == []:
+            return False
+        if overrideFile and self.compressBlocks:
+            return self.persistBlock(overrideFile)
+        self.index.sort(key=lambda tup: tup[0])
+        header = BinaryIndex.BINMAGIC + bytes([(BinaryIndex.WEIGHTSFLAG if self.weights else 0) |
+                                               (BinaryIndex.POSITIONSFLAG if self.positions else 0)])
+        writer = IndexWriter.PartitionWriter(
+            self.outputFolder, self.fileLimit, overrideFile, self.lexicon, header, self.manifest)
+        for token, freqs in self.index:
+            record = self.encodeTerm(token, freqs, overrideFile is None)
+            # only the postings are read by the searcher, not the whole record
+            df, start, end = BinaryIndex.recordPostings(record) if self.lexicon else (len(freqs), 0, None)
+            writer.write(token, record, df, start, end)
+        writer.close()
+        if self.lexicon:
+            self.lexicon.close()
+            self.manifest.close()
+        self.index = []
+        return True
+
+
+class PersistBinaryWeighted(PersistBinary):
+    """
+    Implementation of the binary index persister that persists the weights of the postings, quantized to hundredths, and the idf of the terms.
+    """
+    weights = True
+
+
+class PersistBinaryPosition(PersistBinary):
+    """
+    Implementation of the binary index persister that persists the term frequencies and the positions of the postings.
+    """
+    positions = True
+
+
+class PersistBinaryWeightedPosition(PersistBinary):
+    """
+    Implementation of the binary index persister that persists the weights and the positions of the postings, and the idf of the terms.
+    """
+    weights = True
+    positions = True
@@ -6,9 +6,16 @@
 
 import os
 import math
+import mmap
+import bisect
 import psutil
 from abc import ABC, abstractmethod
 
+import BinaryIndex
+import IndexWriter
+import Lexicon
+import Manifest
+
 
 class Searcher(ABC):
     """
@@ -39,6 +46,7 @@ class Searcher(ABC):
 
         self.files = []
         self.tokenizer = tokenizer
+        self.queryTokens = []
         self.feedback = feedback
         self.rocchioWeights = rocchioWeights
 
@@ -51,10 +59,17 @@ class Searcher(ABC):
         self.maximumRAM = maximumRAM if maximumRAM != None else psutil.virtual_memory().free
 
         self.inputFolder = inputFolder+"/"
-        inputFiles = os.listdir(inputFolder)
-        for f in inputFiles:
-            self.files.append(f)
-        self.files = sorted(self.files)
+        self.manifest = Manifest.openManifest(inputFolder)
+        if self.manifest is not None:
+            self.files = self.manifest.partitions
+        else:
+            inputFiles = os.listdir(inputFolder)
+            for f in inputFiles:
+                # the files starting with "_" (such as the lexicon) aren't partitions of the index
+                if not f.startswith("_"):
+                    self.files.append(f)
+            self.files = sorted(self.files)
+        self.lexicon = Lexicon.openLexicon(inputFolder)
 
         translationFile = open("../indexMetadata.txt")
         self.translations = []
@@ -107,21 +122,20 @@ class IndexSearcher(Searcher):
         super().retrieveRequiredFiles(query)
 
         # tokenize query
-        self.tokenizer.tokenize(query.strip())
+        self.queryTokens = self.tokenizer.tokenize(query.strip())
         # find the index files required
         self.requiredFiles = {"_cached_": []}
-        for t in self.tokenizer.tokens:
+        for t in self.queryTokens:
             if t in self.internalCache:
                 self.requiredFiles["_cached_"].append(t)
             else:
-                for i, file in enumerate(self.files):
-                    if t > file:
-                        if i == len(self.files)-1 or t < self.files[i+1]:
-                            if file not in self.requiredFiles:
-                                self.requiredFiles[file] = [t]
-                            else:
-                                self.requiredFiles[file].append(t)
-                            break
+                file = self.findFile(t)
+                if file is None:
+                    continue
+                if file not in self.requiredFiles:
+                    self.requiredFiles[file] = [t]
+                else:
+                    self.requiredFiles[file].append(t)
 
     def calculateScores(self, queryIdx=None):
         queryTermsIdf = {}
@@ -140,33 +154,23 @@ class IndexSearcher(Searcher):
                     queryTermsIdf[t] = self.internalCache[t][1]
 
             else:  # if file is not in cache
-                for line in open(self.inputFolder+f):
-                    line = line.strip().split(";")[:self.numChamps+1]
-                    curTerm = line[0].split(":")[0]
-                    if curTerm in v:
-                        v.remove(curTerm)
-                        curIdf = float(line[0].split(":")[1])
-                        if self.isMemoryAvailable():
-                            self.internalCache[curTerm] = [
-                                1, curIdf, [(x.split(":")[0], x.split(":")[1]) for x in line[1:]]]
+                for curTerm, curIdf, champions in self.readPostings(self.inputFolder+f, v):
+                    if self.isMemoryAvailable():
+                        self.internalCache[curTerm] = [1, curIdf, champions]
+                    else:
+                        self.internalCache = sorted(
+                            self.internalCache.items(), key=lambda tup: tup[1][0], reverse=True)
+                        self.internalCache = dict(
+                            self.internalCache[:round(len(self.internalCache)/10)])
+                    for docID, weight in champions:  # champions list of size numChamps
+                        docID = int(docID)
+                        if self.translations[docID-1] not in self.scores.keys():
+                            self.scores[self.translations[docID-1]
+                                        ] = float(weight) * curIdf
                         else:
-                            self.internalCache = sorted(
-                                self.internalCache.items(), key=lambda tup: tup[1][0], reverse=True)
-                            self.internalCache = dict(
-                                self.internalCache[:round(len(self.internalCache)/10)])
-                        for c in line[1:]:  # champions list of size numChamps
-                            docID = int(c.split(":")[0])
-                            weight = c.split(":")[1]
-                            if self.translations[docID-1] not in self.scores.keys():
-                                self.scores[self.translations[docID-1]
-                                            ] = float(weight) * curIdf
-                            else:
-                                self.scores[self.translations[docID-1]
-                                            ] += float(weight) * curIdf
-                        queryTermsIdf[curTerm] = curIdf
-
-                        if len(v) <= 0:
-                            break
+                            self.scores[self.translations[docID-1]
+                                        ] += float(weight) * curIdf
+                    queryTermsIdf[curTerm] = curIdf
 
         if self.feedback:
             assert self.rocchioScope, "Error: integer rocchioScope defines the number of docs to be considered relevant in pseudo feedback, if you want this feedback you must define this value"
@@ -195,8 +199,8 @@ class IndexSearcher(Searcher):
                     if self.translations[int(content[0])-1] in relevantDocs:
                         for d in content[1:]:
                             d = d.split(":")
-                            if d[0] not in self.tokenizer.tokens:
-                                self.tokenizer.tokens.append(d[0])
+                            if d[0] not in self.queryTokens:
+                                self.queryTokens.append(d[0])
                             if d[0] in queryTermsIdf.keys():
                                 queryTermsIdf[d[0]] += beta * \
                                     float(d[1])/len(relevantDocs)
@@ -228,8 +232,8 @@ class IndexSearcher(Searcher):
                     if self.translations[int(content[0])-1] in relevantDocs:
                         for d in content[1:]:
                             d = d.split(":")
-                            if d[0] not in self.tokenizer.tokens:
-                                self.tokenizer.tokens.append(d[0])
+                            if d[0] not in self.queryTokens:
+                                self.queryTokens.append(d[0])
                             if d[0] in queryTermsIdf.keys():
                                 queryTermsIdf[d[0]] += beta * \
                                     float(d[1])/len(relevantDocs)
@@ -251,18 +255,17 @@ class IndexSearcher(Searcher):
             self.scores = {}
 
             self.requiredFiles = {"_cached_": []}
-            for t in self.tokenizer.tokens:
+            for t in self.queryTokens:
                 if t in self.internalCache:
                     self.requiredFiles["_cached_"].append(t)
                 else:
-                    for i, file in enumerate(self.files):
-                        if t > file:
-                            if i == len(self.files)-1 or t < self.files[i+1]:
-                                if file not in self.requiredFiles:
-                                    self.requiredFiles[file] = [t]
-                                else:
-                                    self.requiredFiles[file].append(t)
-                                break
+                    file = self.findFile(t)
+                    if file is None:
+                        continue
+                    if file not in self.requiredFiles:
+                        self.requiredFiles[file] = [t]
+                    else:
+                        self.requiredFiles[file].append(t)
 
             for f, v in self.requiredFiles.items():  # for each required file
                 if f == "_cached_":  # if file is in cache
@@ -278,33 +281,145 @@ class IndexSearcher(Searcher):
                                             ] += float(weight) * queryTermsIdf[t]
 
                 else:  # if file is not in cache
-                    for line in open(self.inputFolder+f):
-                        line = line.strip().split(";")[:self.numChamps+1]
-                        curTerm = line[0].split(":")[0]
-                        if curTerm in v:
-                            v.remove(curTerm)
-                            curIdf = float(line[0].split(":")[1])
-                            if self.isMemoryAvailable():
-                                self.internalCache[curTerm] = [
-                                    1, curIdf, [(x.split(":")[0], x.split(":")[1]) for x in line[1:]]]
+                    for curTerm, curIdf, champions in self.readPostings(self.inputFolder+f, v):
+                        if self.isMemoryAvailable():
+                            self.internalCache[curTerm] = [1, curIdf, champions]
+                        else:
+                            self.internalCache = sorted(
+                                self.internalCache.items(), key=lambda tup: tup[1][0], reverse=True)
+                            self.internalCache = dict(
+                                self.internalCache[:round(len(self.internalCache)/10)])
+
+                        for docID, weight in champions:  # champions list of size numChamps
+                            docID = int(docID)
+                            if self.translations[docID-1] not in self.scores.keys():
+                                self.scores[self.translations[docID-1]
+                                            ] = float(weight) * queryTermsIdf[curTerm]
                             else:
-                                self.internalCache = sorted(
-                                    self.internalCache.items(), key=lambda tup: tup[1][0], reverse=True)
-                                self.internalCache = dict(
-                                    self.internalCache[:round(len(self.internalCache)/10)])
-
-                            for c in line[1:]:  # champions list of size numChamps
-                                docID = int(c.split(":")[0])
-                                weight = c.split(":")[1]
-                                if self.translations[int(docID)-1] not in self.scores.keys():
-                                    self.scores[self.translations[int(docID)-1]
-                                                ] = float(weight) * queryTermsIdf[curTerm]
-                                else:
-                                    self.scores[self.translations[int(docID)-1]
-                                                ] += float(weight) * queryTermsIdf[curTerm]
-
-                            if len(v) <= 0:
-                                break
+                                self.scores[self.translations[docID-1]
+                                            ] += float(weight) * queryTermsIdf[curTerm]
+
+    def findFile(self, term):
+        """
+        Auxiliary function that finds the index file where a term would be: the one given by the lexicon, when the index has one, or else the last file whose name (its first term) doesn't come after the term.
+        When the index has a manifest, the terms outside the range of every partition or rejected by its Bloom filter are discarded before the lexicon is searched.
+
+        :param term: the term
+        :type term: str
+        :returns: name of the file, None if the term isn't in the index
+        :rtype: str
+        """
+        if self.manifest is not None:
+            partition = self.manifest.find(term)
+            if partition is None or self.lexicon is None:
+                return partition
+        if self.lexicon is not None:
+            entry = self.lexicon.find(term)
+            return entry[0] if entry else None
+        i = bisect.bisect_right(self.files, term)-1
+        if i < 0:
+            return None
+        return self.files[i]
+
+    def readPostings(self, filename, terms):
+        """
+        Generator that reads the champions lists of some terms from an index file, written either in the CSV format with weights or in the binary format (see BinaryIndex).
+        The terms found are removed from the given list and the file stops being read when it becomes empty.
+        When the index has a lexicon, only the postings of the terms are read, from their position in the file (the positions are never read: they are either kept in their own file, after the postings in the binary format, or cut from the champions of each line), and only their champions tier when the champions lists aren't bigger than it. Otherwise, in the binary format the file is mapped in memory and only the postings of the champions lists are decoded, the other records are skipped.
+
+        :param filename: name of the index file
+        :type filename: str
+        :param terms: terms to be read
+        :type terms: list<str>
+        :returns: generator of tuples (term, idf, champions list), the champions list being pairs (docID, weight), kept as strings in the CSV format
+        :rtype: generator<tuple<str, float, list<tuple<int, float>>>>
+        """
+        if len(terms) <= 0:
+            return
+        binary = BinaryIndex.isBinaryIndex(filename)
+        if self.lexicon is not None:
+            f = open(filename, "rb")
+            # in order, so the file is read forward
+            for term in sorted(set(terms)):
+                _, offset, length, df, idf, _, _, champions = self.lexicon.find(term)
+                # the postings are sorted by weight, so the champions tier has the champions lists up to its size
+                if self.numChamps <= self.lexicon.champions:
+                    length = champions
+                f.seek(offset)
+                postings = f.read(length)
+                if binary:
+                    yield term, idf, [(docID, value/BinaryIndex.QUANTUM) for value, docID in BinaryIndex.decodePostings(postings, 0, length, self.numChamps)]
+                else:
+                    line = str(postings, "utf-8").strip().split(";")[:self.numChamps+1]
+                    yield term, idf, [(x.split(":")[0], x.split(":")[1]) for x in line[1:]]
+            terms.clear()
+            f.close()
+            return
+        if binary:
+            f = open(filename, "rb")
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # the terms are sorted, so the file stops being read after the last one required
+            lastTerm = max(terms)
+            for term, start, stop in BinaryIndex.readRecords(buf):
+                if term in terms:
+                    terms.remove(term)
+                    idf, df, start, end = BinaryIndex.readHeader(buf, start)
+                    yield term, idf/BinaryIndex.QUANTUM, [(docID, value/BinaryIndex.QUANTUM) for value, docID in BinaryIndex.decodePostings(buf, start, end, self.numChamps)]
+                    if len(terms) <= 0:
+                        break
+                elif term > lastTerm:
+                    break
+            buf.close()
+            f.close()
+            return
+        for line in open(filename):
+            line = line.strip().split(";")[:self.numChamps+1]
+            curTerm = line[0].split(":")[0]
+            if curTerm in terms:
+                terms.remove(curTerm)
+                yield curTerm, float(line[0].split(":")[1]), [(x.split(":")[0], x.split(":")[1]) for x in line[1:]]
+                if len(terms) <= 0:
+                    break
+
+    def readPositions(self, term):
+        """
+        Function that loads the positions of a term on demand, for the queries that need them, from wherever the index keeps them: the positions file, the end of its binary record or its line.
+        Only the indexes with a lexicon are supported.
+
+        :param term: the term
+        :type term: str
+        :returns: pairs (docID, positions) of the postings of the term, in the order they are stored, an empty list if the term isn't in the index or the index has no positions
+        :rtype: list<tuple<int, list<int>>>
+        """
+        assert self.lexicon is not None, "Error: the positions can only be read from indexes with a lexicon"
+        entry = self.lexicon.find(term)
+        if entry is None:
+            return []
+        filename, offset, length, df, idf, positionsOffset, positionsLength, _ = entry
+        f = open(self.inputFolder+filename, "rb")
+        if BinaryIndex.isBinaryIndex(self.inputFolder+filename):
+            # the positions follow the postings in the record, one list per posting
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            result = []
+            if buf[len(BinaryIndex.BINMAGIC)] & BinaryIndex.POSITIONSFLAG:
+                pos = offset+length
+                for value, docID in BinaryIndex.decodePostings(buf, offset, offset+length):
+                    docPositions, pos = BinaryIndex.readIncreasing(buf, pos)
+                    result.append((docID, docPositions))
+            buf.close()
+            f.close()
+            return result
+        f.seek(offset)
+        line = str(f.read(length), "utf-8").strip().split(";")[1:]
+        f.close()
+        if positionsOffset is None:
+            # the positions follow each posting in the line
+            return [(int(x.split(":")[0]), [int(p) for p in x.split(":")[2].split(",")]) for x in line if x.count(":") == 2]
+        f = open(self.inputFolder+IndexWriter.POSITIONSFILE, "rb")
+        f.seek(positionsOffset)
+        positions = str(f.read(positionsLength), "utf-8").strip().split(";")
+        f.close()
+        return [(int(x.split(":")[0]), [int(p) for p in docPositions.split(",")]) for x, docPositions in zip(line, positions)]
 
     def sortAndWriteResults(self, outputFile):
         """
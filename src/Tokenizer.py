@@ -4,13 +4,48 @@
 .. moduleauthor:: Filipe Pires [85122] & Joao Alegria [85048]
 """
 import re
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
 import Stemmer
 
+# default number of raw tokens whose final form is memoized by the ComplexTokenizer
+MEMOSIZE = 200000
+
+# copy of the tokenizer used by each tokenizing process, see tokenizeWorker
+workerTokenizer = None
+
+
+def initWorker(tokenizer):
+    """
+    Function executed when each tokenizing process starts (as the initializer of a multiprocessing.Pool), keeping its own copy of the tokenizer.
+
+    :param tokenizer: tokenizer to be used by the process
+    :type tokenizer: Tokenizer
+
+    """
+    global workerTokenizer
+    workerTokenizer = tokenizer
+
+
+def tokenizeWorker(texts):
+    """
+    Function executed by the tokenizing processes, which tokenizes several texts (for instance, the contents of a batch of documents) with the copy of the tokenizer given to initWorker.
+    The tokens of each text are joined by spaces (which they never contain), since one string is much cheaper to send back to the main process than a list of strings.
+
+    :param texts: texts that will be tokenized
+    :type texts: list<str>
+    :returns: one string with the tokens for each text, in the same order
+    :rtype: list<str>
+
+    """
+    return [" ".join(tokens) for tokens in workerTokenizer.tokenizeMany(texts)]
+
 
 class Tokenizer(ABC):
     """
-    Abstract class and interface for the various possible implementations of tokenizers
+    Abstract class and interface for the various possible implementations of tokenizers.
+    The tokens are returned instead of being stored in the instance, so the same tokenizer can be shared by several threads or pipeline stages.
     """
 
     def __init__(self):
@@ -18,7 +53,6 @@ class Tokenizer(ABC):
         Class constructor
         """
         super().__init__()
-        self.tokens = []
 
     @abstractmethod
     def tokenize(self, porcessText):
@@ -27,10 +61,25 @@ class Tokenizer(ABC):
 
         :param processText: text that will be tokenized
         :type processText: str
+        :returns: list of tokens, in the order they appear in the text
+        :rtype: list<str>
 
         """
         pass
 
+    def tokenizeMany(self, texts):
+        """
+        Function that tokenizes several texts at once, for instance the contents of a batch of documents.
+
+        :param texts: texts that will be tokenized
+        :type texts: iterable<str>
+        :returns: one list of tokens for each text, in the same order
+        :rtype: list<list<str>>
+
+        """
+        tokenize = self.tokenize
+        return [tokenize(t) for t in texts]
+
     def clearVar(self):
         """
         Function that frees the memory currently in use by emptying all class variables.
@@ -60,23 +109,16 @@ class SimpleTokenizer(Tokenizer):
 
         :param processText: text that will be tokenized
         :type processText: str
+        :returns: list of tokens
+        :rtype: list<str>
 
         """
-        self.tokens = self.regex2.split(
-            self.regex1.sub(" ", processText.lower()))
-        self.tokens = [t for t in self.tokens if len(t) >= 3]
-
-    def clearTokens(self):
-        """
-        Function that frees memory by emptying the tokens list.
-        """
-        self.tokens = []
+        return [t for t in self.regex2.split(self.regex1.sub(" ", processText.lower())) if len(t) >= 3]
 
     def clearVar(self):
         """
         Function that frees the memory currently in use by emptying all class variables.
         """
-        self.tokens = []
         self.regex1 = None
         self.regex2 = None
 
@@ -84,26 +126,36 @@ class SimpleTokenizer(Tokenizer):
 class ComplexTokenizer(Tokenizer):
     """
     Implementation of a tokenizer dedicated to the current context of RI. This instance is the complex implementation porposed in 2.2. This version uses the PorterStemmer, eliminates stop words and implements some personal rules in relation to special characters(split by [ -_], keeps dates, emails, money, digits, ... ; eliminates majority of the punctuantion)
+    Since the vocabulary is Zipfian, the final tokens produced by each raw token are memoized in a bounded LRU memo.
+    One instance can be shared by several threads: each thread stems with its own stemmer (a Stemmer has internal state, so it must not be called concurrently) and a concurrent eviction from the memo only costs a recomputation.
+
+    :param memoSize: maximum number of raw tokens kept in the memo
+    :type memoSize: int
     """
 
-    def __init__(self):
+    def __init__(self, memoSize=MEMOSIZE):
         """
         Class constructor
         """
         super().__init__()
-        # loading PorterStemmer
-        # self.stemmer = Stemmer.Stemmer('english')
-        # fetching stopWords
-        self.stopWords = []
+        # PorterStemmer of each thread, loaded by processToken the first time the thread needs it and kept for the whole life of the tokenizer
+        self.stemmers = threading.local()
+        # raw token -> tuple of final tokens, ordered from the least to the most recently used
+        self.memo = OrderedDict()
+        self.memoSize = memoSize
+        self.memoHits = 0
+        self.memoMisses = 0
+        # fetching stopWords, kept in a set for constant time lookups
         f = open("snowball_stopwords_EN.txt", "r")
-        for line in f:
-            self.stopWords.append(line.strip())
+        self.stopWords = set(line.strip() for line in f)
+        f.close()
         # storing usefull regex
         self.regex0 = re.compile(" +")
-        self.regex1 = re.compile(" +| *_+ *| *-+ *")
-        self.regex2 = re.compile("([',;.:?!\(\)\[\]\{\}\"\|#])")
+        # words of a raw token: sequences of characters between spaces, underscores, hyphens and punctuation
+        self.regex1 = re.compile("[^ _\-',;.:?!\(\)\[\]\{\}/\"\|#]+")
+        # words of a raw token containing a date: the same as regex1, but slashes are kept
+        self.regex2 = re.compile("[^ _\-',;.:?!\(\)\[\]\{\}\"\|#]+")
         self.regex3 = re.compile("[0-9]+(/)[0-9]+(/)[0-9]+")
-        self.regex4 = re.compile("([',;.:?!\(\)\[\]\{\}/\"\|#])")
         self.regex5 = re.compile("^(-)?[0-9]")
 
     def tokenize(self, processText):
@@ -112,25 +164,87 @@ class ComplexTokenizer(Tokenizer):
 
         :param processText: text that will be tokenized
         :type processText: str
+        :returns: list of tokens
+        :rtype: list<str>
+
+        """
+        tokens = []
+        memo = self.memo
+        for t in self.regex0.split(processText.lower()):
+            finalTokens = memo.get(t)
+            if finalTokens is None:
+                self.memoMisses += 1
+                finalTokens = self.processToken(t)
+                memo[t] = finalTokens
+                if len(memo) > self.memoSize:
+                    try:
+                        memo.popitem(last=False)
+                    except KeyError:  # emptied by another thread
+                        pass
+            else:
+                self.memoHits += 1
+                try:
+                    memo.move_to_end(t)
+                except KeyError:  # evicted by another thread
+                    pass
+            tokens += finalTokens
+        return tokens
+
+    def processToken(self, token):
+        """
+        Auxiliary function that applies the stop words list, the rules and the stemmer to one raw token (obtained by splitting the text by spaces).
+
+        :param token: raw token, already in lower case
+        :type token: str
+        :returns: the final tokens produced by the raw token
+        :rtype: tuple<str>
+
+        """
+        if token in self.stopWords:
+            return ()
+        # a single pass extracts the words, keeping the slashes if the token contains a date
+        additionalWords = self.regex2.findall(token) if self.regex3.search(
+            token) else self.regex1.findall(token)
+        stemmer = getattr(self.stemmers, "stemmer", None)
+        if stemmer is None:
+            stemmer = self.stemmers.stemmer = Stemmer.Stemmer('english')
+        return tuple(t for t in stemmer.stemWords(additionalWords) if len(t) > 2)
 
+    def __getstate__(self):
         """
-        stemmer = Stemmer.Stemmer('english')
-        self.tokens = []
-        intermidiateTokens = [t for t in self.regex0.split(
-            processText.lower()) if t not in self.stopWords]
-        for t in intermidiateTokens:
-            t = self.regex2.sub(" ", t) if self.regex3.search(
-                t) else self.regex4.sub(" ", t)
-            additionalWords = list(filter(None, self.regex1.split(t)))
-            self.tokens += additionalWords
-        self.tokens = [t for t in stemmer.stemWords(self.tokens)if len(t) > 2]
-        stemmer = None
+        Function used when the tokenizer is pickled, for instance to be sent to another process.
+        The stemmers can't be pickled and the memo is left behind, so each process builds its own.
 
-    def clearTokens(self):
+        :returns: the state of the tokenizer, without the stemmers and the memo
+        :rtype: dict
+
+        """
+        state = self.__dict__.copy()
+        state["stemmers"] = None
+        state["memo"] = OrderedDict()
+        return state
+
+    def __setstate__(self, state):
+        """
+        Function used when the tokenizer is unpickled, leaving room for the stemmers of its threads.
+
+        :param state: the state returned by __getstate__
+        :type state: dict
+
+        """
+        self.__dict__.update(state)
+        self.stemmers = threading.local()
+
+    def memoInfo(self):
         """
-        Function that frees memory by emptying the tokens list.
+        Function that reports the usage of the memo, useful to choose its size.
+        The counters are updated without a lock, so they are approximate when the tokenizer is shared by several threads.
+
+        :returns: number of hits, number of misses and current number of raw tokens in the memo
+        :rtype: tuple<int, int, int>
+
         """
-        self.tokens = []
+        return self.memoHits, self.memoMisses, len(self.memo)
 
     def clearVar(self):
         """
@@ -139,7 +253,7 @@ class ComplexTokenizer(Tokenizer):
         self.regex1 = None
         self.regex2 = None
         self.regex3 = None
-        self.regex4 = None
         self.regex5 = None
-        self.tokens = []
-        self.stopWords = []
+        self.stopWords = set()
+        self.stemmers = threading.local()
+        self.memo = OrderedDict()
@@ -40,7 +40,7 @@ for n in N:
                         key=lambda kv: kv[1], reverse=True)
 
         requiredFiles = []
-        for term in searcher.tokenizer.tokens:
+        for term in searcher.queryTokens:
             for f in inputFiles:
                 aux = f.split("_")
                 if term > aux[0] and term < aux[1]:
@@ -62,7 +62,7 @@ for n in N:
         for file in requiredFiles:
             f = open(inputFolder+file)
             for l in f:
-                if l.split(":")[0] in searcher.tokenizer.tokens:
+                if l.split(":")[0] in searcher.queryTokens:
                     content = l.strip().split(";")[1:]
                     for c in content:
                         c = c.split(":")
@@ -110,7 +110,7 @@ for n in N:
         for file in requiredFiles:
             f = open(inputFolder+file)
             for l in f:
-                if l.split(":")[0] in searcher.tokenizer.tokens:
+                if l.split(":")[0] in searcher.queryTokens:
                     content = l.strip().split(";")[1:]
                     for c in content:
                         c = c.split(":")
@@ -0,0 +1,78 @@
+"""
+.. module:: Tokenizer Check Auxiliary Script
+    :noindex:
+.. moduleauthor:: Filipe Pires [85122] & Joao Alegria [85048]
+"""
+
+import re
+import sys
+
+import Stemmer
+
+import FileParser
+import Tokenizer
+
+# input file checked when none is given
+INPUTFILE = "../extraInput/2004_TREC_ASCII_MEDLINE_sample10k.gz"
+
+
+class ReferenceTokenizer(Tokenizer.Tokenizer):
+    """
+    Original rule chain of the ComplexTokenizer (stop words in a list, then a substitution of the punctuation and a split by spaces, underscores and hyphens per raw token), kept as the golden output the ComplexTokenizer must reproduce.
+    """
+
+    def __init__(self):
+        """
+        Class constructor
+        """
+        super().__init__()
+        self.stemmer = Stemmer.Stemmer('english')
+        self.stopWords = []
+        f = open("snowball_stopwords_EN.txt", "r")
+        for line in f:
+            self.stopWords.append(line.strip())
+        f.close()
+        self.regex0 = re.compile(" +")
+        self.regex1 = re.compile(" +| *_+ *| *-+ *")
+        self.regex2 = re.compile("([',;.:?!\(\)\[\]\{\}\"\|#])")
+        self.regex3 = re.compile("[0-9]+(/)[0-9]+(/)[0-9]+")
+        self.regex4 = re.compile("([',;.:?!\(\)\[\]\{\}/\"\|#])")
+
+    def tokenize(self, processText):
+        """
+        Implementation of the original complex tokenization process.
+
+        :param processText: text that will be tokenized
+        :type processText: str
+        :returns: list of tokens
+        :rtype: list<str>
+
+        """
+        tokens = []
+        intermidiateTokens = [t for t in self.regex0.split(
+            processText.lower()) if t not in self.stopWords]
+        for t in intermidiateTokens:
+            t = self.regex2.sub(" ", t) if self.regex3.search(
+                t) else self.regex4.sub(" ", t)
+            tokens += list(filter(None, self.regex1.split(t)))
+        return [t for t in self.stemmer.stemWords(tokens) if len(t) > 2]
+
+
+inputFile = sys.argv[1] if len(sys.argv) > 1 else INPUTFILE
+reference = ReferenceTokenizer()
+tokenizer = Tokenizer.ComplexTokenizer()
+numDocs = 0
+numTokens = 0
+
+# each document is tokenized twice, so the tokens given by the memo are checked as well
+for docID, content in FileParser.readDocuments(inputFile):
+    expected = reference.tokenize(content)
+    for tokens in (tokenizer.tokenize(content), tokenizer.tokenize(content)):
+        if tokens != expected:
+            differences = [(e, t) for e, t in zip(expected, tokens) if e != t]
+            print("Document " + docID + " differs (" + str(len(expected)) + " expected tokens, " + str(len(tokens)) + " tokens): " + str(differences[:10]))
+            sys.exit(1)
+    numDocs += 1
+    numTokens += len(expected)
+
+print("Checked " + str(numDocs) + " documents and " + str(numTokens) + " tokens: the output is the same")
@@ -0,0 +1,121 @@
+"""
+.. module:: Weights Check Auxiliary Script
+    :noindex:
+.. moduleauthor:: Filipe Pires [85122] & Joao Alegria [85048]
+"""
+
+import os
+import sys
+import random
+import shutil
+import tempfile
+import subprocess
+
+import Indexer
+import Tokenizer
+
+# input folder checked when none is given
+INPUTFOLDER = "../extraInput"
+# number of random synthetic documents whose weights are compared
+SYNTHETICDOCS = 300
+# options of each build compared, the first one with and the first one without a memory limitation (weights calculated while indexing, in a single block) give the reference index and documents cache
+BUILDS = [["-w", "-r", "1"],
+          ["-w", "-r", "0.04"],
+          ["-w"],
+          ["-w", "-v"],
+          ["-w", "-v", "-r", "1"],
+          ["-w", "-v", "-r", "0.04"],
+          ["-w", "-v", "-r", "0.04", "-n", "4"],
+          ["-w", "-v", "-r", "0.04", "-m", "3"]]
+
+
+def buildIndex(options, inputFolder):
+    """
+    Function that builds an index with the given options in a temporary folder and reads it, with the documents cache written with it.
+    CreateIndex writes the documents cache to the parent of its working directory, so it runs in its own folder to leave the one of the repository untouched.
+
+    :param options: options given to CreateIndex
+    :type options: list<str>
+    :param inputFolder: folder with the input files
+    :type inputFolder: str
+    :returns: contents of the partitions of the index, joined in order (the partitions depend on the options), and best terms of each document, by PMID (the internal docIDs depend on the options)
+    :rtype: tuple<bytes, dict<str, str>>
+
+    """
+    folder = tempfile.mkdtemp()
+    try:
+        workFolder = folder+"/src"
+        os.mkdir(workFolder)
+        shutil.copy("snowball_stopwords_EN.txt", workFolder)
+        subprocess.run([sys.executable, os.path.abspath("CreateIndex.py")] + options + ["-o", folder+"/index", os.path.abspath(inputFolder)],
+                       cwd=workFolder, stdout=subprocess.DEVNULL, check=True)
+        index = b""
+        for filename in sorted(os.listdir(folder+"/index")):
+            f = open(folder+"/index/"+filename, "rb")
+            index += f.read()
+            f.close()
+        f = open(folder+"/indexMetadata.txt", "r")
+        translation = dict(line.strip().split(",") for line in f)
+        f.close()
+        cache = {}
+        f = open(folder+"/docCache", "r")
+        for line in f:
+            docID, sep, bestTerms = line.strip().partition(";")
+            cache[translation[docID]] = bestTerms
+        f.close()
+        return index, cache
+    finally:
+        shutil.rmtree(folder)
+
+
+def indexWeights(tokensList, deferWeights):
+    """
+    Function that indexes documents already tokenized, with the weights calculated while indexing or in the deferred weights mode.
+
+    :param tokensList: tokens of each document
+    :type tokensList: list<list<str>>
+    :param deferWeights: flag that indicates if the deferred weights mode is used
+    :type deferWeights: boolean
+    :returns: documents and weights of the postings of each term and best terms of each document
+    :rtype: tuple<dict<str, tuple<list<int>, list<float>>>, dict<int, list<tuple<str, float>>>>
+
+    """
+    indexer = Indexer.FileIndexer(Tokenizer.SimpleTokenizer(), False, True, deferWeights=deferWeights)
+    indexer.indexBatch([(str(i), "") for i in range(len(tokensList))], tokensList)
+    return {term: (list(postings.docs), list(postings.weights)) for term, postings in indexer.items()}, indexer.bestTerms
+
+
+# synthetic documents with weights the sample doesn't have: every weight of a document with 1600 different terms, each one appearing once, is exactly half-way between 0.02 and 0.03
+random.seed(0)
+tokensList = [["term"+str(i) for i in range(1600)], ["term"]*300+["other"]*7]
+for i in range(SYNTHETICDOCS):
+    vocabulary = random.choice((10, 100, 1000, 10000))
+    tokensList.append(["term"+str(random.randrange(vocabulary))
+                       for j in range(random.randint(1, 3000))])
+if indexWeights(tokensList, False) != indexWeights(tokensList, True):
+    print("synthetic documents: the weights differ with -v")
+    sys.exit(1)
+print("synthetic documents: the same weights and best terms with -v")
+
+inputFolder = sys.argv[1] if len(sys.argv) > 1 else INPUTFOLDER
+# reference index of the builds with and without a memory limitation (without it, the parser skips the first document)
+references = {}
+reference = None
+
+for options in BUILDS:
+    index, cache = buildIndex(options, inputFolder)
+    if reference is None:
+        reference = cache
+    limited = "-r" in options
+    if limited not in references:
+        references[limited] = index
+    elif index != references[limited]:
+        print(" ".join(options) + ": the index differs")
+        sys.exit(1)
+    # only the documents of the build are compared, since the reference documents cache may have one more
+    differences = [(pmid, reference.get(pmid), cache[pmid])
+                   for pmid in cache if reference.get(pmid) != cache[pmid]]
+    if differences:
+        print(" ".join(options) + ": " + str(len(differences)) + " documents differ, for instance " + str(differences[:3]))
+        sys.exit(1)
+    print(" ".join(options) + ": the same index and documents cache (" + str(len(cache)) + " documents)")